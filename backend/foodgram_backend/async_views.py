@@ -0,0 +1,176 @@
+import time
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .middleware import current_timings
+
+# Сколько частей синхронного итератора читается за один переход
+# в синхронный поток.
+STREAM_BATCH_SIZE = 16
+
+
+def streaming_content(request, iterator, batch_size=STREAM_BATCH_SIZE):
+    """
+    Содержимое StreamingHttpResponse. Под ASGI Django 4.2 читает
+    синхронный итератор целиком через sync_to_async(list), поэтому
+    ему отдается асинхронный итератор; под WSGI - сам итератор.
+    """
+    if not isinstance(getattr(request, '_request', request), ASGIRequest):
+        return iterator
+
+    def take():
+        return list(islice(iterator, batch_size))
+
+    async def content():
+        # Все части читаются в одном синхронном потоке
+        # (thread_sensitive): курсор базы не переходит между потоками.
+        while batch := await sync_to_async(take)():
+            for part in batch:
+                yield part
+
+    return content()
+
+
+class AsyncReadMixin:
+    """
+    Асинхронное чтение для вьюсета DRF под ASGI. GET-запросы
+    к действиям из async_actions обрабатываются корутинами
+    a<действие> (alist, aretrieve) в цикле событий, остальные
+    запросы - синхронным путем DRF. Включается настройкой
+    ASYNC_VIEWS, которую задает foodgram_backend.asgi.
+    """
+
+    async_actions = ()
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        action = actions.get('get')
+        if not settings.ASYNC_VIEWS or action not in cls.async_actions:
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = {'get': action, 'head': action}
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        async_view.cls = cls
+        async_view.initkwargs = initkwargs
+        async_view.actions = actions
+        async_view.csrf_exempt = True
+        return async_view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """
+        Асинхронный вариант APIView.dispatch. Проверки initial()
+        (троттлинг, права, закрепление за основной базой) могут
+        обращаться к кэшу и базе, поэтому выполняются в синхронном
+        потоке; изменения контекстных переменных asgiref переносит
+        обратно в цикл событий.
+        """
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.aperform_authentication(request)
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def aperform_authentication(self, request):
+        """
+        Аутентификаторы с методом aauthenticate обращаются к базе
+        асинхронно, остальные вызываются в синхронном потоке.
+        """
+        timings = current_timings()
+        started_at = time.perf_counter()
+        try:
+            for authenticator in request.authenticators:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth = await authenticator.aauthenticate(request)
+                else:
+                    user_auth = await sync_to_async(
+                        authenticator.authenticate
+                    )(request)
+                if user_auth is not None:
+                    request.user, request.auth = user_auth
+                    return
+            request.user, request.auth = AnonymousUser(), None
+        except APIException:
+            request.user, request.auth = AnonymousUser(), None
+            raise
+        finally:
+            if timings is not None:
+                timings.add('auth', time.perf_counter() - started_at)
+
+    async def afilter_queryset(self, queryset):
+        """
+        Фильтры filterset_class проверяются синхронно и могут
+        обращаться к базе, поэтому выполняются в синхронном
+        потоке и только при наличии параметров фильтров.
+        """
+        filterset_class = getattr(self, 'filterset_class', None)
+        if filterset_class is None or not (
+            filterset_class.base_filters.keys()
+            & self.request.query_params.keys()
+        ):
+            return queryset
+        return await sync_to_async(self.filter_queryset)(queryset)
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(
+            queryset, self.request, view=self
+        )
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            [obj async for obj in queryset], many=True
+        )
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(await self.aget_object())
+        return Response(serializer.data)
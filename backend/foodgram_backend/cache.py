@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.exceptions import ImproperlyConfigured
+
+# Кэши в памяти процесса: записи и сбросы не видны
+# другим процессам сервера.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache(alias=DEFAULT_CACHE_ALIAS):
+    """
+    Кэш общий для всех процессов сервера (Redis, memcached).
+    """
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def require_shared_cache():
+    """
+    Закрепление за основной базой после записи и версии индексов
+    в памяти хранятся в кэше и должны быть видны всем процессам:
+    с репликами или несколькими процессами сервера кэш в памяти
+    процесса не подходит, и приложение не запускается.
+    """
+    if not is_shared_cache() and (
+        settings.DATABASE_REPLICAS or settings.WEB_CONCURRENCY > 1
+    ):
+        raise ImproperlyConfigured(
+            'Для реплик и нескольких процессов сервера нужен общий кэш: '
+            'укажите CACHE_BACKEND и CACHE_LOCATION (например, Redis).'
+        )
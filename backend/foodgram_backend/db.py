@@ -0,0 +1,85 @@
+from django.db import connections, router
+from django.db.models.sql import DeleteQuery
+
+
+def insert_link(model, values, target_field, target_id):
+    """
+    Создание строки связи одним запросом
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING:
+    строка вставляется, только если объект target_id существует
+    и такой связи еще нет. Возвращает True, если строка вставлена.
+    Поддерживаются PostgreSQL и SQLite 3.35+.
+    """
+    return bool(insert_links(model, values, target_field, [target_id]))
+
+
+def insert_links(model, values, target_field, target_ids):
+    """
+    Создание строк связи с объектами target_ids одним запросом,
+    как insert_link. Возвращает id объектов, для которых строка
+    вставлена этим запросом.
+    """
+    if not target_ids:
+        return []
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    target = opts.get_field(target_field)
+    target_opts = target.related_model._meta
+    target_pk = qn(target_opts.pk.column)
+    columns = [opts.get_field(name).column for name in values]
+    placeholders = ', '.join(['%s'] * len(target_ids))
+    sql = (
+        f'INSERT INTO {qn(opts.db_table)} '
+        f'({", ".join(map(qn, [*columns, target.column]))}) '
+        f'SELECT {"%s, " * len(values)}{target_pk} '
+        f'FROM {qn(target_opts.db_table)} '
+        f'WHERE {target_pk} IN ({placeholders}) '
+        f'ON CONFLICT DO NOTHING RETURNING {qn(target.column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*values.values(), *target_ids])
+        return [target_id for target_id, in cursor.fetchall()]
+
+
+def insert_from_select(model, fields, queryset):
+    """
+    Перенос строк выборки в таблицу модели одним запросом
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING. Колонки
+    queryset (values_list) идут в порядке fields, в выборке
+    должно быть условие WHERE (требование SQLite).
+    Возвращает число вставленных строк.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    columns = [opts.get_field(name).column for name in fields]
+    select, params = queryset.query.get_compiler(using).as_sql()
+    sql = (
+        f'INSERT INTO {qn(opts.db_table)} '
+        f'({", ".join(map(qn, columns))}) {select} '
+        f'ON CONFLICT DO NOTHING'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def delete_returning(queryset, fields):
+    """
+    Удаление строк выборки одним запросом DELETE ... RETURNING
+    без сигналов и каскадов. Возвращает значения fields
+    удаленных строк. Поддерживаются PostgreSQL и SQLite 3.35+.
+    """
+    using = router.db_for_write(queryset.model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = queryset.model._meta
+    columns = [qn(opts.get_field(name).column) for name in fields]
+    query = queryset.query.chain(DeleteQuery)
+    sql, params = query.get_compiler(using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {", ".join(columns)}', params)
+        return cursor.fetchall()
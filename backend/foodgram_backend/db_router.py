@@ -0,0 +1,98 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_KEY = 'db:primary-pin:{}'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Чтение внутри блока идет с реплик,
+    при enabled=False - с основной базы.
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_reads():
+    """
+    Чтение с основной базы для данных, которые надолго попадают
+    в кэш или индексы в памяти: отставание реплики в них
+    сохранилось бы до следующего изменения.
+    """
+    return replica_reads(False)
+
+
+def pin_to_primary(user):
+    cache.set(PIN_KEY.format(user.pk), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(PIN_KEY.format(user.pk), False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись и чтение по умолчанию идут в основную базу default,
+    чтение внутри replica_reads() - в случайную реплику
+    из DATABASE_REPLICAS.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and _replica_reads.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема на реплики приходит репликацией.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Безопасные запросы вьюсета читают с реплик. После запроса
+    на изменение чтение пользователя REPLICA_PIN_SECONDS секунд
+    идет с основной базы, чтобы он видел свои изменения.
+    Токен проверяется до переключения, на основной базе.
+    Прежнее значение восстанавливается set, а не reset по токену:
+    в асинхронных вьюсетах initial выполняется в синхронном
+    потоке, а finalize_response - в цикле событий.
+    """
+
+    replica_previous = None
+    pinned_user = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            if request.user.is_authenticated:
+                self.pinned_user = request.user
+        elif not is_pinned(request.user):
+            self.replica_previous = _replica_reads.get()
+            _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.replica_previous is not None:
+            _replica_reads.set(self.replica_previous)
+            self.replica_previous = None
+        if self.pinned_user is not None:
+            pin_to_primary(self.pinned_user)
+        return super().finalize_response(request, response, *args, **kwargs)
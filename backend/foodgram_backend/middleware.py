@@ -0,0 +1,188 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('foodgram.timing')
+
+_current_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Разбивка времени обработки запроса по этапам.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.db_time = 0.0
+        self.db_count = 0
+        self._started = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def start(self, name):
+        self._started[name] = (time.perf_counter(), self.db_time)
+
+    def stop(self, name):
+        """
+        Завершение этапа; время запросов к БД внутри
+        этапа учитывается отдельно в db.
+        """
+        started = self._started.pop(name, None)
+        if started is None:
+            return
+        started_at, db_time = started
+        self.add(name, time.perf_counter() - started_at
+                 - (self.db_time - db_time))
+
+    def execute(self, execute, sql, params, many, context):
+        """
+        Обертка connection.execute_wrapper для учета запросов.
+        """
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started_at
+            self.db_count += 1
+
+    def as_dict(self):
+        data = {
+            f'{name}_ms': round(duration * 1000, 2)
+            for name, duration in self.durations.items()
+        }
+        data['db_ms'] = round(self.db_time * 1000, 2)
+        data['db_queries'] = self.db_count
+        return data
+
+    def header(self):
+        metrics = [
+            f'{name};dur={duration * 1000:.2f}'
+            for name, duration in self.durations.items()
+        ]
+        metrics.append(
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_count} queries"'
+        )
+        return ', '.join(metrics)
+
+
+def current_timings():
+    """
+    Замеры текущего запроса или None, если замеры выключены.
+    """
+    return _current_timings.get()
+
+
+class ServerTimingMiddleware:
+    """
+    Замер времени обработки запроса: аутентификация, запросы к БД,
+    сериализация и рендеринг. Результат отдается в заголовке
+    Server-Timing и пишется в лог foodgram.timing.
+    Включается настройкой SERVER_TIMING.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        started_at = time.perf_counter()
+        try:
+            with self.measure_queries(timings):
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self.finish(request, response, timings, started_at)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        started_at = time.perf_counter()
+        # Соединения с БД привязаны к потоку: обертки ставятся
+        # в синхронном потоке запроса, где выполняются запросы.
+        stack = await sync_to_async(self.measure_queries)(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current_timings.reset(token)
+        return self.finish(request, response, timings, started_at)
+
+    def measure_queries(self, timings):
+        """
+        Учет запросов всех соединений текущего потока.
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings.execute))
+        return stack
+
+    def finish(self, request, response, timings, started_at):
+        timings.add('total', time.perf_counter() - started_at)
+        response['Server-Timing'] = timings.header()
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **timings.as_dict(),
+        }))
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        Рендеринг ответа DRF внутри замера; повторный вызов
+        render() в обработчике Django ничего не делает.
+        """
+        timings = current_timings()
+        started_at = time.perf_counter()
+        response.render()
+        timings.add('render', time.perf_counter() - started_at)
+        return response
+
+
+class ServerTimingMixin:
+    """
+    Замер аутентификации и работы обработчика вьюсета
+    для ServerTimingMiddleware.
+    """
+
+    def perform_authentication(self, request):
+        timings = current_timings()
+        if timings is None:
+            return super().perform_authentication(request)
+        started_at = time.perf_counter()
+        try:
+            return super().perform_authentication(request)
+        finally:
+            timings.add('auth', time.perf_counter() - started_at)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        timings = current_timings()
+        if timings is not None:
+            timings.start('serialize')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        timings = current_timings()
+        if timings is not None:
+            timings.stop('serialize')
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -29,9 +29,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram_backend.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -72,6 +72,24 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS=host1,host2:5433.
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1
+):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['foodgram_backend.db_router.PrimaryReplicaRouter']
+# Сколько секунд после изменения пользователь читает с основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -102,7 +120,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS':
@@ -115,6 +133,95 @@ REST_FRAMEWORK = {
 }
 
 
+###########################
+#  CACHE
+###########################
+# Кэш в памяти процесса годится только для одного процесса;
+# для нескольких воркеров нужен общий кэш, например
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# и CACHE_LOCATION=redis://redis:6379/0.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('.LocMemCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+    }
+# Число процессов сервера; gunicorn читает ту же переменную.
+# При нескольких процессах или репликах нужен общий кэш.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Кэш токенов: общий кэш (если CACHE_BACKEND общий) и LRU
+# в памяти процесса.
+TOKEN_CACHE_TIMEOUT = 60 * 5
+TOKEN_LOCAL_CACHE_TIMEOUT = int(os.getenv('TOKEN_LOCAL_CACHE_TIMEOUT', 5))
+TOKEN_LOCAL_CACHE_MAX_ENTRIES = 10000
+
+
+###########################
+#  SUBSCRIPTION FEED
+###########################
+# Сколько последних записей хранится в ленте пользователя.
+FEED_SIZE = int(os.getenv('FEED_SIZE', 500))
+# С какого числа подписчиков рецепты автора не рассылаются
+# по лентам, а читаются при запросе ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+
+
+###########################
+#  SIMILAR RECIPES
+###########################
+# Сколько похожих рецептов хранится для каждого рецепта.
+SIMILAR_RECIPES_COUNT = 10
+
+
+###########################
+#  RECIPE RANKINGS
+###########################
+# За сколько дней вклад добавления в избранное или список покупок
+# убывает вдвое: для ordering=popular и для ordering=trending.
+POPULAR_HALF_LIFE_DAYS = float(os.getenv('POPULAR_HALF_LIFE_DAYS', 30))
+TRENDING_HALF_LIFE_DAYS = float(os.getenv('TRENDING_HALF_LIFE_DAYS', 2))
+
+
+###########################
+#  PERFORMANCE MONITORING
+###########################
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+
+# Асинхронные вьюхи чтения; включаются при запуске через ASGI.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'foodgram.images': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
 ###########################
 #  DJOSER CONFIG
 ###########################
@@ -150,6 +257,27 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/media'
 
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Уменьшенные копии картинок рецептов готовятся в пуле потоков.
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+RECIPE_IMAGE_FORMATS = ('avif', 'webp')
+RECIPE_IMAGE_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Ограничения на загружаемые картинки; файлы из multipart/form-data
+# сразу пишутся во временный файл, а не в память.
+RECIPE_IMAGE_MAX_BYTES = int(os.getenv('RECIPE_IMAGE_MAX_BYTES', 10 * 2 ** 20))
+RECIPE_IMAGE_MAX_PIXELS = int(os.getenv('RECIPE_IMAGE_MAX_PIXELS', 40_000_000))
+# Тело JSON-запроса с картинкой в base64 больше самой картинки на треть.
+DATA_UPLOAD_MAX_MEMORY_SIZE = RECIPE_IMAGE_MAX_BYTES * 4 // 3 + 2 ** 20
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 
 ###########################
 #  CORS HEADERS
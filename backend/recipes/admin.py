@@ -1,6 +1,34 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count
+from users.models import CustomUser
 
-from .models import Ingredient, IngredientsRecipe, Recipe, Tag
+from .cookable import cookable_index
+from .counters import change_counter
+from .images import schedule
+from .models import (FeedEntry, Ingredient, IngredientsRecipe, Recipe,
+                     ShoppingCartIngredient, Tag)
+from .search import update_search_documents
+
+
+def mark_similar_stale(recipe_ids):
+    """
+    Пересчет списков похожих рецептов после изменения
+    тегов или состава в админ-зоне.
+    """
+    Recipe.objects.filter(pk__in=recipe_ids).update(similar_stale=True)
+
+
+def ingredient_rows(rows):
+    """
+    Количества ингредиентов по парам (id рецепта, id ингредиента).
+    """
+    return {
+        (recipe_id, ingredient_id): amount
+        for recipe_id, ingredient_id, amount in rows.values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        )
+    }
 
 
 class IngredientsInline(admin.TabularInline):
@@ -28,7 +56,7 @@ class RecipesAdmin(admin.ModelAdmin):
     Настройка админ-зоны для модели рецепта.
     """
 
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count')
     list_filter = ('name', 'author', 'tags')
     empty_value_display = "-пусто-"
     inlines = [
@@ -41,10 +69,70 @@ class RecipesAdmin(admin.ModelAdmin):
         Получение количества добавлений
         рецепта в избранное.
         """
-        return obj.favorite_recipes.count()
+        return obj.favorites_count
 
     count_recipes_favorite.short_description = 'Популярность'
 
+    def save_model(self, request, obj, form, change):
+        """
+        Изменение счетчиков рецептов авторов и лент подписчиков
+        при создании рецепта и смене автора.
+        """
+        super().save_model(request, obj, form, change)
+        if not change:
+            change_counter(CustomUser.objects.filter(pk=obj.author_id),
+                           'recipes_count', 1)
+            FeedEntry.objects.fan_out([obj.pk])
+        elif 'author' in form.changed_data:
+            FeedEntry.objects.filter(recipe=obj).delete()
+            FeedEntry.objects.fan_out([obj.pk])
+            change_counter(
+                CustomUser.objects.filter(pk=form.initial['author']),
+                'recipes_count', -1,
+            )
+            change_counter(CustomUser.objects.filter(pk=obj.author_id),
+                           'recipes_count', 1)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            change_counter(CustomUser.objects.filter(pk=obj.author_id),
+                           'recipes_count', -1)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        """
+        Удаление выбранных рецептов с уменьшением
+        счетчиков рецептов их авторов.
+        """
+        with transaction.atomic():
+            for author_id, count in queryset.order_by().values(
+                'author'
+            ).annotate(count=Count('pk')).values_list('author', 'count'):
+                change_counter(CustomUser.objects.filter(pk=author_id),
+                               'recipes_count', -count)
+            super().delete_queryset(request, queryset)
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Обновление списков покупок, поискового документа, индекса
+        ингредиентов и похожих рецептов после сохранения тегов
+        и ингредиентов рецепта.
+        """
+        rows = IngredientsRecipe.objects.filter(recipe=form.instance)
+        before = ingredient_rows(rows)
+        super().save_related(request, form, formsets, change)
+        ShoppingCartIngredient.objects.apply_row_changes(
+            before, ingredient_rows(rows)
+        )
+        if not change or 'tags' in form.changed_data or any(
+            formset.has_changed() for formset in formsets
+        ):
+            mark_similar_stale([form.instance.pk])
+        update_search_documents([form.instance.pk])
+        cookable_index.mark_changed([form.instance.pk])
+        if 'image' in form.changed_data:
+            schedule(form.instance.pk)
+
 
 class TagsAdmin(admin.ModelAdmin):
     """
@@ -59,6 +147,17 @@ class TagsAdmin(admin.ModelAdmin):
     ]
     exclude = ('tags',)
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Пересчет похожих рецептов после изменения рецептов тега.
+        """
+        rows = Recipe.tags.through.objects.filter(tag=form.instance)
+        before = set(rows.values_list('recipe_id', flat=True))
+        super().save_related(request, form, formsets, change)
+        mark_similar_stale(
+            before ^ set(rows.values_list('recipe_id', flat=True))
+        )
+
 
 class IngredientsAdmin(admin.ModelAdmin):
     """
@@ -72,6 +171,25 @@ class IngredientsAdmin(admin.ModelAdmin):
         IngredientsInline
     ]
 
+    def save_related(self, request, form, formsets, change):
+        """
+        Обновление списков покупок, поисковых документов, индекса
+        ингредиентов и похожих рецептов после изменения строк
+        ингредиента в рецептах. Количество в поиск и индексы
+        не входит: для них важны добавленные и удаленные строки.
+        """
+        rows = IngredientsRecipe.objects.filter(ingredient=form.instance)
+        before = ingredient_rows(rows)
+        super().save_related(request, form, formsets, change)
+        after = ingredient_rows(rows)
+        ShoppingCartIngredient.objects.apply_row_changes(before, after)
+        recipe_ids = {
+            recipe_id for recipe_id, _ in before.keys() ^ after.keys()
+        }
+        mark_similar_stale(recipe_ids)
+        update_search_documents(recipe_ids)
+        cookable_index.mark_changed(recipe_ids)
+
 
 admin.site.register(Recipe, RecipesAdmin)
 admin.site.register(Tag, TagsAdmin)
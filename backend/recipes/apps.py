@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from foodgram_backend.cache import require_shared_cache
+
+        from . import signals  # noqa: F401
+        from .search import install, require_search_backend
+        post_migrate.connect(install, sender=self)
+        require_shared_cache()
+        require_search_backend()
@@ -0,0 +1,535 @@
+"""
+Нагрузочный прогон API: синтетические данные, сценарии
+для каждого маршрута и сравнение с эталонными замерами.
+"""
+import base64
+import io
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser, Follow
+
+from . import rankings, similar
+from .counters import reconcile
+from .models import (FavoriteRecipe, FeedEntry, Ingredient, IngredientsRecipe,
+                     Recipe, ShoppingCart, ShoppingCartIngredient, Tag)
+from .search import update_search_documents
+
+BENCHMARK_PASSWORD = 'benchmark-password-42'
+BENCHMARK_IMAGE = 'recipes/benchmark.png'
+# Номер пользователя с правами администратора.
+BENCHMARK_ADMIN = 3
+BASELINE_PATH = settings.BASE_DIR / 'data' / 'benchmark_baseline.json'
+# Настройки прогона. Реплики не входят в тестовую базу: чтение
+# с основной. Токены в кэше процесса не истекают во время замера:
+# число запросов не зависит от длительности сценария. Адреса
+# из писем djoser нужны только сценариям активации и сброса.
+BENCHMARK_SETTINGS = {
+    'DATABASE_REPLICAS': [],
+    'TOKEN_LOCAL_CACHE_TIMEOUT': 60 * 60,
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'DJOSER': {
+        **settings.DJOSER,
+        'ACTIVATION_URL': '#/activate/{uid}/{token}',
+        'PASSWORD_RESET_CONFIRM_URL': '#/password/reset/confirm/{uid}/{token}',
+        'USERNAME_RESET_CONFIRM_URL': '#/email/reset/confirm/{uid}/{token}',
+    },
+}
+
+
+def pixel_png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def pixel_png():
+    """
+    Однопиксельный PNG для сценариев создания и изменения рецепта.
+    """
+    return 'data:image/png;base64,' + base64.b64encode(
+        pixel_png_bytes()
+    ).decode()
+
+
+@dataclass
+class Scenario:
+    """
+    Один замеряемый запрос к API.
+    """
+
+    name: str
+    url_name: str
+    method: str
+    path: Union[str, Callable]
+    data: Union[dict, Callable, None] = None
+    user: Optional[str] = 'main'
+    format: str = 'json'
+    content_type: Optional[str] = None
+
+
+@dataclass
+class Result:
+    """
+    Результат замера сценария.
+    """
+
+    name: str
+    statuses: set = field(default_factory=set)
+    queries: int = 0
+    timings: list = field(default_factory=list)
+    size: int = 0
+
+    def percentile(self, value):
+        ordered = sorted(self.timings)
+        index = min(len(ordered) - 1, round(value / 100 * (len(ordered) - 1)))
+        return ordered[index] * 1000
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'p50_ms': round(self.percentile(50), 2),
+            'p95_ms': round(self.percentile(95), 2),
+            'bytes': self.size,
+        }
+
+
+def seed(users=200, recipes=2000, ingredients_per_recipe=8,
+         tags_per_recipe=2, follows_per_user=20, cart_size=30, rng=None):
+    """
+    Заполнение базы синтетическими данными bulk-запросами.
+    """
+    rng = rng or random.Random(42)
+    if not Ingredient.objects.exists():
+        with open(settings.BASE_DIR / 'data' / 'ingredients.json',
+                  encoding='utf-8') as f:
+            Ingredient.objects.bulk_create(
+                Ingredient(**row) for row in json.load(f)
+            )
+    tags = Tag.objects.bulk_create(
+        Tag(name=f'tag{i}', color=f'#{i:06d}', slug=f'tag{i}')
+        for i in range(6)
+    )
+    password = make_password(BENCHMARK_PASSWORD)
+    authors = CustomUser.objects.bulk_create(
+        CustomUser(
+            email=f'user{i}@benchmark.local',
+            username=f'user{i}',
+            first_name='Имя',
+            last_name='Фамилия',
+            password=password,
+            is_staff=i == BENCHMARK_ADMIN,
+        ) for i in range(users)
+    )
+    main = authors[0]
+    Recipe.objects.bulk_create(
+        Recipe(
+            name=f'Рецепт {i}',
+            author=rng.choice(authors),
+            image=BENCHMARK_IMAGE,
+            text='Описание рецепта. ' * 20,
+            cooking_time=rng.randint(5, 120),
+        ) for i in range(recipes)
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    IngredientsRecipe.objects.bulk_create(
+        IngredientsRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                          amount=rng.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rng.sample(ingredient_ids,
+                                        ingredients_per_recipe)
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+        for recipe_id in recipe_ids
+        for tag in rng.sample(tags, tags_per_recipe)
+    )
+    Follow.objects.bulk_create(
+        Follow(user=user, author=author)
+        for user in authors
+        for author in rng.sample(authors[1:], follows_per_user)
+        if author != user
+    )
+    for model in (FavoriteRecipe, ShoppingCart):
+        model.objects.bulk_create(
+            model(user=main, recipe_id=recipe_id)
+            for recipe_id in rng.sample(recipe_ids, cart_size)
+        )
+    ShoppingCartIngredient.objects.rebuild()
+    reconcile()
+    rankings.rebuild()
+    FeedEntry.objects.rebuild()
+    similar.rebuild()
+    update_search_documents(recipe_ids)
+    return main
+
+
+class Context:
+    """
+    Идентификаторы объектов, с которыми работают сценарии.
+    """
+
+    def __init__(self, repeat):
+        self.main = CustomUser.objects.get(username='user0')
+        self.other = CustomUser.objects.get(username='user1')
+        self.spare = CustomUser.objects.get(username='user2')
+        self.admin = CustomUser.objects.get(
+            username=f'user{BENCHMARK_ADMIN}'
+        )
+        self.recipe = Recipe.objects.filter(author=self.main).first()
+        in_lists = set(
+            FavoriteRecipe.objects.filter(user=self.main)
+            .values_list('recipe_id', flat=True)
+        ) | set(
+            ShoppingCart.objects.filter(user=self.main)
+            .values_list('recipe_id', flat=True)
+        )
+        self.free_recipes = list(
+            Recipe.objects.exclude(id__in=in_lists)
+            .values_list('id', flat=True)[:repeat]
+        )
+        self.batch_recipes = list(
+            Recipe.objects.exclude(id__in=in_lists)
+            .values_list('id', flat=True)[repeat:repeat + 20]
+        )
+        followed = Follow.objects.filter(
+            user=self.main).values_list('author_id', flat=True)
+        self.free_authors = list(
+            CustomUser.objects.exclude(id__in=followed)
+            .exclude(id=self.main.id)
+            .values_list('id', flat=True)[:repeat]
+        )
+        self.ingredients = list(
+            Ingredient.objects.values_list('id', flat=True)[:3]
+        )
+        self.pantry = list(
+            Ingredient.objects.annotate(
+                used=Count('recipes')
+            ).order_by('-used').values_list('id', flat=True)[:300]
+        )
+        self.tag = Tag.objects.first()
+        self.created_recipes = []
+        self.image = pixel_png()
+        self.tokens = {
+            'main': Token.objects.get_or_create(user=self.main)[0].key,
+            'spare': Token.objects.get_or_create(user=self.spare)[0].key,
+            'admin': Token.objects.get_or_create(user=self.admin)[0].key,
+        }
+
+    def recipe_payload(self, i):
+        return {
+            'name': f'Новый рецепт {i}',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in self.ingredients
+            ],
+        }
+
+    def import_payload(self, i, size=20):
+        ingredients = Ingredient.objects.filter(pk__in=self.ingredients)
+        return ''.join(
+            json.dumps({
+                'name': f'Загруженный рецепт {i}-{n}',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'author': self.main.email,
+                'image': BENCHMARK_IMAGE,
+                'tags': [self.tag.slug],
+                'ingredients': [
+                    {'name': ingredient.name,
+                     'measurement_unit': ingredient.measurement_unit,
+                     'amount': 10}
+                    for ingredient in ingredients
+                ],
+            }, ensure_ascii=False) + '\n'
+            for n in range(size)
+        ).encode()
+
+    def recipe_multipart_payload(self, i):
+        payload = self.recipe_payload(i)
+        payload['image'] = SimpleUploadedFile(
+            'image.png', pixel_png_bytes(), 'image/png'
+        )
+        payload['ingredients'] = json.dumps(payload['ingredients'])
+        return payload
+
+
+def default_scenarios():
+    """
+    Сценарии для всех маршрутов recipes/urls.py и users/urls.py.
+    Порядок важен: сценарии удаления идут после сценариев добавления.
+    """
+    def free_recipe(action):
+        return lambda ctx, i: (
+            f'/api/recipes/{ctx.free_recipes[i]}/{action}/'
+        )
+
+    def subscribe(ctx, i):
+        return f'/api/users/{ctx.free_authors[i]}/subscribe/'
+
+    def batch(ctx, i):
+        return {'recipes': ctx.batch_recipes}
+
+    def created_recipe(ctx, i):
+        return f'/api/recipes/{ctx.created_recipes[i]}/'
+
+    return [
+        Scenario('recipes_list', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6'),
+        Scenario('recipes_list_anonymous', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6', user=None),
+        Scenario('recipes_list_tags', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&tags=tag1&tags=tag2'),
+        Scenario('recipes_list_favorited', 'recipes-list', 'get',
+                 '/api/recipes/?is_favorited=1&limit=6'),
+        Scenario('recipes_list_shopping_cart', 'recipes-list', 'get',
+                 '/api/recipes/?is_in_shopping_cart=1&limit=6'),
+        Scenario('recipes_list_deep_page', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&page=100'),
+        Scenario('recipes_list_cursor', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&cursor='),
+        Scenario('recipes_list_popular', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&ordering=popular'),
+        Scenario('recipes_list_trending_cursor', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&ordering=trending&cursor='),
+        Scenario('recipes_search', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&search=%D1%81%D0%BE%D0%BB%D1%8C'),
+        Scenario('recipes_search_tags', 'recipes-list', 'get',
+                 '/api/recipes/?limit=6&tags=tag1'
+                 '&search=%D1%80%D0%B5%D1%86%D0%B5%D0%BF%D1%82'),
+        Scenario('recipes_cookable', 'recipes-cookable', 'get',
+                 lambda ctx, i: '/api/recipes/cookable/?limit=6&missing=5&'
+                 + '&'.join(f'ingredients={pk}' for pk in ctx.pantry)),
+        Scenario('recipes_feed', 'recipes-feed', 'get',
+                 '/api/recipes/feed/?limit=6'),
+        Scenario('recipes_similar', 'recipes-similar', 'get',
+                 lambda ctx, i: f'/api/recipes/{ctx.recipe.pk}/similar/'),
+        Scenario('recipes_create', 'recipes-list', 'post',
+                 '/api/recipes/', lambda ctx, i: ctx.recipe_payload(i)),
+        Scenario('recipes_create_multipart', 'recipes-list', 'post',
+                 '/api/recipes/',
+                 lambda ctx, i: ctx.recipe_multipart_payload(i),
+                 format='multipart'),
+        Scenario('recipes_detail', 'recipes-detail', 'get',
+                 lambda ctx, i: f'/api/recipes/{ctx.recipe.id}/'),
+        Scenario('recipes_update', 'recipes-detail', 'patch',
+                 created_recipe, lambda ctx, i: ctx.recipe_payload(i)),
+        Scenario('recipes_partial_update', 'recipes-detail', 'patch',
+                 created_recipe,
+                 lambda ctx, i: {'name': f'Измененный рецепт {i}'}),
+        Scenario('recipes_delete', 'recipes-detail', 'delete',
+                 created_recipe),
+        Scenario('favorite_add', 'recipes-favorite', 'post',
+                 free_recipe('favorite')),
+        Scenario('favorite_delete', 'recipes-favorite', 'delete',
+                 free_recipe('favorite')),
+        Scenario('favorite_batch_add', 'recipes-favorite-batch', 'post',
+                 '/api/recipes/favorite/batch/', batch),
+        Scenario('favorite_batch_delete', 'recipes-favorite-batch',
+                 'delete', '/api/recipes/favorite/batch/', batch),
+        Scenario('shopping_cart_add', 'recipes-shopping-cart', 'post',
+                 free_recipe('shopping_cart')),
+        Scenario('download_shopping_cart',
+                 'recipes-download-shopping-cart', 'get',
+                 '/api/recipes/download_shopping_cart/'),
+        Scenario('download_shopping_cart_csv',
+                 'recipes-download-shopping-cart', 'get',
+                 '/api/recipes/download_shopping_cart/?format=csv'),
+        Scenario('download_shopping_cart_pdf',
+                 'recipes-download-shopping-cart', 'get',
+                 '/api/recipes/download_shopping_cart/?format=pdf'),
+        Scenario('shopping_cart_delete', 'recipes-shopping-cart', 'delete',
+                 free_recipe('shopping_cart')),
+        Scenario('shopping_cart_batch_add', 'recipes-shopping-cart-batch',
+                 'post', '/api/recipes/shopping_cart/batch/', batch),
+        Scenario('shopping_cart_batch_delete', 'recipes-shopping-cart-batch',
+                 'delete', '/api/recipes/shopping_cart/batch/', batch),
+        Scenario('recipes_export', 'recipes-export', 'get',
+                 '/api/recipes/export/', user='admin'),
+        Scenario('recipes_import', 'recipes-import', 'post',
+                 '/api/recipes/import/',
+                 lambda ctx, i: ctx.import_payload(i),
+                 user='admin', content_type='application/x-ndjson'),
+        Scenario('ingredients_list', 'ingredients-list', 'get',
+                 '/api/ingredients/', user=None),
+        Scenario('ingredients_search', 'ingredients-list', 'get',
+                 '/api/ingredients/?name=%D1%81%D0%BE', user=None),
+        Scenario('ingredients_detail', 'ingredients-detail', 'get',
+                 lambda ctx, i: f'/api/ingredients/{ctx.ingredients[0]}/',
+                 user=None),
+        Scenario('tags_list', 'tags-list', 'get', '/api/tags/', user=None),
+        Scenario('tags_detail', 'tags-detail', 'get',
+                 lambda ctx, i: f'/api/tags/{ctx.tag.id}/', user=None),
+        Scenario('users_list', 'users-list', 'get', '/api/users/?limit=6'),
+        Scenario('users_create', 'users-list', 'post', '/api/users/',
+                 lambda ctx, i: {
+                     'email': f'new{i}@benchmark.local',
+                     'username': f'new{i}',
+                     'first_name': 'Имя',
+                     'last_name': 'Фамилия',
+                     'password': BENCHMARK_PASSWORD,
+                 }, user=None),
+        Scenario('users_detail', 'users-detail', 'get',
+                 lambda ctx, i: f'/api/users/{ctx.other.id}/'),
+        Scenario('users_me', 'users-me', 'get', '/api/users/me/'),
+        Scenario('users_me_update', 'users-me', 'patch', '/api/users/me/',
+                 {'first_name': 'Имя'}),
+        Scenario('subscriptions', 'users-subscriptions', 'get',
+                 '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+        Scenario('subscriptions_cursor', 'users-subscriptions', 'get',
+                 '/api/users/subscriptions/?limit=6&recipes_limit=3'
+                 '&cursor='),
+        Scenario('subscribe', 'users-subscribe', 'post', subscribe),
+        Scenario('unsubscribe', 'users-subscribe', 'delete', subscribe),
+        Scenario('set_password', 'users-set-password', 'post',
+                 '/api/users/set_password/', {
+                     'current_password': BENCHMARK_PASSWORD,
+                     'new_password': BENCHMARK_PASSWORD,
+                 }),
+        Scenario('set_email', 'users-set-username', 'post',
+                 '/api/users/set_email/', {'new_email': 'x'}),
+        Scenario('activation', 'users-activation', 'post',
+                 '/api/users/activation/', {'uid': 'x', 'token': 'x'},
+                 user=None),
+        Scenario('resend_activation', 'users-resend-activation', 'post',
+                 '/api/users/resend_activation/',
+                 {'email': 'user5@benchmark.local'}, user=None),
+        Scenario('reset_password', 'users-reset-password', 'post',
+                 '/api/users/reset_password/',
+                 {'email': 'user5@benchmark.local'}, user=None),
+        Scenario('reset_password_confirm', 'users-reset-password-confirm',
+                 'post', '/api/users/reset_password_confirm/',
+                 {'uid': 'x', 'token': 'x', 'new_password': 'x'},
+                 user=None),
+        Scenario('reset_email', 'users-reset-username', 'post',
+                 '/api/users/reset_email/',
+                 {'email': 'user5@benchmark.local'}, user=None),
+        Scenario('reset_email_confirm', 'users-reset-username-confirm',
+                 'post', '/api/users/reset_email_confirm/',
+                 {'uid': 'x', 'token': 'x', 'new_email': 'x'}, user=None),
+        Scenario('token_login', 'login', 'post', '/api/auth/token/login/', {
+            'email': 'user0@benchmark.local',
+            'password': BENCHMARK_PASSWORD,
+        }, user=None),
+        Scenario('token_logout', 'logout', 'post', '/api/auth/token/logout/',
+                 user='spare'),
+    ]
+
+
+def api_route_names(prefix='api/'):
+    """
+    Имена всех маршрутов API, подключенных из recipes и users.
+    """
+    names = set()
+
+    def walk(patterns, path=''):
+        for pattern in patterns:
+            current = path + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, current)
+            elif (isinstance(pattern, URLPattern)
+                  and current.startswith(prefix)
+                  and pattern.name and pattern.name != 'api-root'
+                  and not pattern.name.startswith('customuser-')):
+                names.add(pattern.name)
+
+    walk(get_resolver().url_patterns)
+    return names
+
+
+def run_scenario(scenario, ctx, repeat):
+    """
+    Выполнение сценария repeat раз с подсчетом SQL-запросов.
+    """
+    result = Result(scenario.name)
+    client = APIClient(raise_request_exception=False)
+    if scenario.user:
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {ctx.tokens[scenario.user]}'
+        )
+    options = (
+        {'content_type': scenario.content_type} if scenario.content_type
+        else {'format': scenario.format}
+    )
+    for i in range(repeat):
+        path = scenario.path
+        if callable(path):
+            path = path(ctx, i)
+        data = scenario.data(ctx, i) if callable(scenario.data) else (
+            scenario.data
+        )
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(
+                path, data, **options
+            )
+            if getattr(response, 'streaming', False):
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+            result.timings.append(time.perf_counter() - started)
+        result.statuses.add(response.status_code)
+        result.queries = max(result.queries, len(queries))
+        result.size = max(result.size, len(content))
+        if (scenario.name.startswith('recipes_create')
+                and response.status_code == 201):
+            ctx.created_recipes.append(response.json()['id'])
+        if scenario.name == 'token_logout':
+            ctx.tokens['spare'] = Token.objects.create(user=ctx.spare).key
+            client.credentials(
+                HTTP_AUTHORIZATION=f'Token {ctx.tokens["spare"]}'
+            )
+    return result
+
+
+def compare(results, baseline, latency_tolerance, size_tolerance,
+            latency_floor_ms=10):
+    """
+    Список регрессий относительно эталона. Колебания задержки
+    меньше latency_floor_ms регрессией не считаются.
+    """
+    failures = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            failures.append(f'{result.name}: нет эталонного замера')
+            continue
+        actual = result.as_dict()
+        if actual['queries'] > expected['queries']:
+            failures.append(
+                f'{result.name}: SQL-запросов {actual["queries"]}, '
+                f'эталон {expected["queries"]}'
+            )
+        if actual['bytes'] > expected['bytes'] * (1 + size_tolerance):
+            failures.append(
+                f'{result.name}: размер ответа {actual["bytes"]} байт, '
+                f'эталон {expected["bytes"]}'
+            )
+        if latency_tolerance is None:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if (actual[key] > expected[key] * (1 + latency_tolerance)
+                    and actual[key] - expected[key] > latency_floor_ms):
+                failures.append(
+                    f'{result.name}: {key} {actual[key]}, '
+                    f'эталон {expected[key]}'
+                )
+    return failures
@@ -0,0 +1,133 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from foodgram_backend.db_router import primary_reads
+
+from .images import absolute_srcset
+from .models import Recipe
+from .serializers import RecipeSerializer
+
+# Версия формата закэшированного представления: увеличивается
+# при изменении полей RecipeSerializer.
+PUBLIC_VERSION = 3
+# Ключ представления: id рецепта и его версия Recipe.cache_version.
+PUBLIC_KEY = 'recipes:public:{}:{}'
+
+
+def public_key(recipe_id, cache_version):
+    return PUBLIC_KEY.format(recipe_id, cache_version)
+
+
+def invalidate(recipe_ids):
+    """
+    Смена версий рецептов в той же транзакции, что и изменение.
+    Чтение, начатое до изменения, запишет в кэш представление
+    под старой версией, которую после фиксации уже не запрашивают;
+    старые записи вытесняются по времени жизни.
+    """
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        cache_version=F('cache_version') + 1
+    )
+
+
+def store_public_representations(recipe_ids):
+    """
+    Сериализация общих представлений рецептов одной пачкой
+    и запись в кэш под версиями, прочитанными вместе с данными.
+    Данные читаются с основной базы.
+    """
+    recipes = Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).with_user_flags(None).with_related()
+    with primary_reads():
+        data = RecipeSerializer(recipes, many=True).data
+    cache.set_many(
+        {
+            public_key(recipe.pk, recipe.cache_version): item
+            for recipe, item in zip(recipes, data)
+        },
+        timeout=settings.RECIPE_CACHE_TIMEOUT,
+        version=PUBLIC_VERSION,
+    )
+    return {item['id']: item for item in data}
+
+
+def get_public_representations(recipes):
+    """
+    Общая для всех пользователей часть представлений рецептов.
+    Отсутствующие в кэше рецепты сериализуются одной пачкой
+    без запроса, поэтому ссылки на картинки в них относительные.
+    """
+    keys = {
+        recipe.pk: public_key(recipe.pk, recipe.cache_version)
+        for recipe in recipes
+    }
+    cached = cache.get_many(keys.values(), version=PUBLIC_VERSION)
+    public = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached
+    }
+    missing = [recipe_id for recipe_id in keys if recipe_id not in public]
+    if missing:
+        public.update(store_public_representations(missing))
+    return public
+
+
+async def aget_public_representations(recipes):
+    """
+    Асинхронный вариант get_public_representations.
+    """
+    keys = {
+        recipe.pk: public_key(recipe.pk, recipe.cache_version)
+        for recipe in recipes
+    }
+    cached = await cache.aget_many(keys.values(), version=PUBLIC_VERSION)
+    public = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached
+    }
+    missing = [recipe_id for recipe_id in keys if recipe_id not in public]
+    if missing:
+        public.update(
+            await sync_to_async(store_public_representations)(missing)
+        )
+    return public
+
+
+def apply_user_flags(recipes, public, request):
+    """
+    Общие представления с флагами пользователя
+    и абсолютными ссылками на картинки.
+    """
+    data = []
+    for recipe in recipes:
+        if recipe.pk not in public:
+            continue
+        item = dict(public[recipe.pk])
+        item['is_favorited'] = recipe.is_favorited
+        item['is_in_shopping_cart'] = recipe.is_in_shopping_cart
+        item['favorites_count'] = recipe.favorites_count
+        item['author'] = dict(
+            item['author'], is_subscribed=recipe.author_is_subscribed
+        )
+        if item['image']:
+            item['image'] = request.build_absolute_uri(item['image'])
+        item['image_srcset'] = absolute_srcset(item['image_srcset'], request)
+        data.append(item)
+    return data
+
+
+def render_recipes(recipes, request):
+    """
+    Представления рецептов: общая часть из кэша, флаги
+    пользователя из аннотаций with_user_flags и счетчик
+    избранного, который меняется без сброса кэша.
+    """
+    public = get_public_representations(recipes)
+    return apply_user_flags(recipes, public, request)
+
+
+async def arender_recipes(recipes, request):
+    public = await aget_public_representations(recipes)
+    return apply_user_flags(recipes, public, request)
@@ -0,0 +1,275 @@
+import threading
+import uuid
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from foodgram_backend.db_router import primary_reads
+
+from .models import IngredientsRecipe
+
+EPOCH_KEY = 'recipes:cookable-index-epoch'
+COUNTER_KEY = 'recipes:cookable-index-counter'
+CHANGE_KEY = 'recipes:cookable-index-change:{}'
+CHANGE_TIMEOUT = 60 * 60
+MAX_MISSING = 5
+
+
+def bitmap(ids):
+    """
+    Целое число, в котором установлены биты с номерами ids.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+def bits_desc(value):
+    """
+    Номера установленных битов по убыванию.
+    """
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+    for index in range(len(data) - 1, -1, -1):
+        byte = data[index]
+        if byte:
+            for bit in range(7, -1, -1):
+                if byte >> bit & 1:
+                    yield index * 8 + bit
+
+
+class IndexState:
+    """
+    Неизменяемый снимок индекса: ингредиенты рецептов, битовые
+    карты рецептов по ингредиентам и по числу ингредиентов.
+    """
+
+    def __init__(self, recipes, by_ingredient, by_size):
+        self.recipes = recipes
+        self.by_ingredient = by_ingredient
+        self.by_size = by_size
+
+    @classmethod
+    def build(cls, rows):
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in rows:
+            recipes[recipe_id].add(ingredient_id)
+        by_ingredient = defaultdict(list)
+        by_size = defaultdict(list)
+        for recipe_id, ingredients in recipes.items():
+            by_size[len(ingredients)].append(recipe_id)
+            for ingredient_id in ingredients:
+                by_ingredient[ingredient_id].append(recipe_id)
+        return cls(
+            {pk: frozenset(items) for pk, items in recipes.items()},
+            {pk: bitmap(ids) for pk, ids in by_ingredient.items()},
+            {size: bitmap(ids) for size, ids in by_size.items()},
+        )
+
+    def patch(self, recipe_ids, rows):
+        """
+        Новый снимок, в котором рецепты recipe_ids заменены
+        строками rows; рецепты без строк удаляются.
+        """
+        fresh = defaultdict(set)
+        for recipe_id, ingredient_id in rows:
+            fresh[recipe_id].add(ingredient_id)
+        recipes = dict(self.recipes)
+        by_ingredient = dict(self.by_ingredient)
+        by_size = dict(self.by_size)
+        for recipe_id in recipe_ids:
+            bit = 1 << recipe_id
+            old = recipes.pop(recipe_id, frozenset())
+            if old:
+                by_size[len(old)] &= ~bit
+            for ingredient_id in old:
+                by_ingredient[ingredient_id] &= ~bit
+            new = fresh.get(recipe_id)
+            if not new:
+                continue
+            recipes[recipe_id] = frozenset(new)
+            by_size[len(new)] = by_size.get(len(new), 0) | bit
+            for ingredient_id in new:
+                by_ingredient[ingredient_id] = (
+                    by_ingredient.get(ingredient_id, 0) | bit
+                )
+        return IndexState(recipes, by_ingredient, by_size)
+
+    def match(self, ingredient_ids, max_missing):
+        """
+        Битовые карты рецептов, в которых есть хотя бы один из
+        ingredient_ids и не хватает ровно 0, 1, ... max_missing
+        ингредиентов.
+        """
+        maps = [
+            self.by_ingredient[pk] for pk in set(ingredient_ids)
+            if pk in self.by_ingredient
+        ]
+        # Побитовый счетчик совпавших ингредиентов: planes[j] -
+        # рецепты, у которых j-й бит количества совпадений равен 1.
+        planes = []
+        candidates = 0
+        for carry in maps:
+            candidates |= carry
+            for index, plane in enumerate(planes):
+                planes[index], carry = plane ^ carry, plane & carry
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+
+        equal = {}
+
+        def matched_exactly(count):
+            if count not in equal:
+                mask = candidates if count >> len(planes) == 0 else 0
+                for index, plane in enumerate(planes):
+                    if not mask:
+                        break
+                    mask &= plane if count >> index & 1 else ~plane
+                equal[count] = mask
+            return equal[count]
+
+        return [
+            self._union(
+                recipes & matched_exactly(size - missing)
+                for size, recipes in self.by_size.items()
+                if size - missing > 0
+            )
+            for missing in range(max_missing + 1)
+        ]
+
+    @staticmethod
+    def _union(maps):
+        result = 0
+        for value in maps:
+            result |= value
+        return result
+
+
+class CookableResult:
+    """
+    Результат поиска как последовательность пар (id рецепта,
+    число недостающих ингредиентов) для Paginator: сначала
+    рецепты с меньшим числом недостающих, затем более новые.
+    """
+
+    def __init__(self, groups):
+        self.groups = [(missing, value, popcount(value))
+                       for missing, value in enumerate(groups) if value]
+
+    def __len__(self):
+        return sum(size for _, _, size in self.groups)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Поддерживаются только срезы')
+        start, stop, _ = index.indices(len(self))
+        result = []
+        for missing, value, size in self.groups:
+            if start >= size:
+                start -= size
+                stop -= size
+                continue
+            for position, recipe_id in enumerate(bits_desc(value)):
+                if position >= stop:
+                    break
+                if position >= start:
+                    result.append((recipe_id, missing))
+            start, stop = 0, stop - size
+            if stop <= 0:
+                break
+        return result
+
+
+class CookableIndex:
+    """
+    Инвертированный индекс ингредиент -> битовая карта рецептов
+    в памяти процесса. Изменения рецептов записываются в кэш
+    журналом, и каждый процесс применяет их к своему индексу;
+    при потере журнала индекс перестраивается целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._state = IndexState({}, {}, {})
+
+    def invalidate(self):
+        """
+        Полное перестроение индекса во всех процессах.
+        """
+        cache.set(EPOCH_KEY, uuid.uuid4().hex, None)
+
+    def mark_changed(self, recipe_ids):
+        """
+        Запись изменившихся рецептов в журнал после фиксации
+        транзакции.
+        """
+        recipe_ids = list(recipe_ids)
+        if recipe_ids:
+            transaction.on_commit(lambda: self._log(recipe_ids))
+
+    def _log(self, recipe_ids):
+        cache.add(COUNTER_KEY, 0, None)
+        try:
+            counter = cache.incr(COUNTER_KEY)
+        except ValueError:
+            self.invalidate()
+            return
+        cache.set(CHANGE_KEY.format(counter), recipe_ids, CHANGE_TIMEOUT)
+
+    def _current_version(self):
+        return (
+            cache.get_or_set(EPOCH_KEY, uuid.uuid4().hex, None),
+            cache.get_or_set(COUNTER_KEY, 0, None),
+        )
+
+    def _refresh(self, version):
+        if self._version is not None and self._version[0] == version[0]:
+            local, shared = self._version[1], version[1]
+            keys = [CHANGE_KEY.format(n) for n in range(local + 1, shared + 1)]
+            changes = cache.get_many(keys)
+            if local <= shared and len(changes) == len(keys):
+                recipe_ids = {pk for ids in changes.values() for pk in ids}
+                self._state = self._state.patch(
+                    recipe_ids,
+                    IngredientsRecipe.objects.filter(
+                        recipe_id__in=recipe_ids
+                    ).values_list('recipe_id', 'ingredient_id'),
+                )
+                self._version = version
+                return
+        self._state = IndexState.build(
+            IngredientsRecipe.objects.values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator(chunk_size=10000)
+        )
+        self._version = version
+
+    def _ensure_fresh(self):
+        version = self._current_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    with primary_reads():
+                        self._refresh(version)
+        return self._state
+
+    def search(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, для которых из ingredient_ids не хватает
+        не более max_missing ингредиентов.
+        """
+        state = self._ensure_fresh()
+        return CookableResult(state.match(ingredient_ids, max_missing))
+
+
+cookable_index = CookableIndex()
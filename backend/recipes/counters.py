@@ -0,0 +1,58 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from users.models import CustomUser, Follow
+
+from .models import FavoriteRecipe, Recipe, ShoppingCart
+
+# Счетчик: модель, поле, модель связанных строк и поле связи с моделью.
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Follow, 'author'),
+    (CustomUser, 'following_count', Follow, 'user'),
+)
+
+
+def change_counter(queryset, field, delta, **updates):
+    """
+    Атомарное изменение счетчика одним UPDATE без чтения строки;
+    updates - другие поля, изменяемые тем же запросом.
+    """
+    if delta:
+        queryset.update(
+            **{field: Greatest(F(field) + delta, Value(0))}, **updates
+        )
+
+
+def actual_count(related, link):
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{link: OuterRef('pk')}
+            ).order_by().values(link).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0),
+    )
+
+
+def reconcile(dry_run=False):
+    """
+    Сверка счетчиков с фактическим количеством строк и
+    исправление расхождений. Возвращает число неверных
+    значений для каждого счетчика.
+    """
+    drift = {}
+    for model, field, related, link in COUNTERS:
+        wrong = model.objects.annotate(
+            actual=actual_count(related, link)
+        ).exclude(**{field: F('actual')})
+        label = f'{model._meta.model_name}.{field}'
+        drift[label] = wrong.count()
+        if drift[label] and not dry_run:
+            model.objects.filter(pk__in=wrong.values('pk')).update(
+                **{field: actual_count(related, link)}
+            )
+    return drift
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import re
+import uuid
+
+import filetype
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import ImageField
+
+WHITESPACE = re.compile(r'\s')
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Картинка рецепта: файл из multipart/form-data или строка
+    base64. Base64 декодируется частями во временный файл;
+    размер в байтах и пикселях проверяется до полного
+    декодирования изображения.
+    """
+
+    chunk_size = 64 * 1024
+    # Файл, декодированный из base64 при последней проверке.
+    decoded = None
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if isinstance(data, str):
+            data = self.decoded = self.decode(data)
+        if not isinstance(data, UploadedFile):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        self.check_size(data.size)
+        self.check_pixels(data)
+        return ImageField.to_internal_value(self, data)
+
+    def discard(self):
+        """
+        Удаление временного файла, если данные сериализатора
+        не прошли проверку и сохранения не будет.
+        """
+        if self.decoded is not None:
+            self.decoded.close()
+            self.decoded = None
+
+    def check_size(self, size):
+        limit = settings.RECIPE_IMAGE_MAX_BYTES
+        if size > limit:
+            raise ValidationError(
+                f'Размер картинки не должен превышать {limit} байт.'
+            )
+
+    def check_pixels(self, file):
+        """
+        Проверка размеров по заголовку файла: Image.open
+        не декодирует пиксели.
+        """
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        finally:
+            file.seek(0)
+        limit = settings.RECIPE_IMAGE_MAX_PIXELS
+        if width * height > limit:
+            raise ValidationError(
+                f'Картинка не должна содержать больше {limit} пикселей.'
+            )
+
+    def decode(self, data):
+        """
+        Декодирование base64 частями во временный файл.
+        """
+        content_type = None
+        if ';base64,' in data:
+            header, data = data.split(';base64,', 1)
+            if self.trust_provided_content_type:
+                content_type = header.replace('data:', '')
+        if WHITESPACE.search(data):
+            data = WHITESPACE.sub('', data)
+        self.check_size(len(data) * 3 // 4 - data[-2:].count('='))
+
+        file = TemporaryUploadedFile(
+            str(uuid.uuid4()), content_type, 0, None
+        )
+        step = self.chunk_size - self.chunk_size % 4
+        try:
+            for start in range(0, len(data), step):
+                file.write(base64.b64decode(data[start:start + step]))
+        except (TypeError, binascii.Error, ValueError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        file.size = file.tell()
+        file.seek(0)
+        extension = filetype.guess_extension(file.read(261))
+        file.seek(0)
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        file.name = f'{file.name}.{extension}'
+        return file
@@ -1,6 +1,8 @@
 from django_filters import rest_framework as filters
 
 from .models import Ingredient, Recipe
+from .rankings import ORDERINGS
+from .search import search
 
 
 class IngredientFilter(filters.FilterSet):
@@ -21,7 +23,8 @@ class IngredientFilter(filters.FilterSet):
 class RecipeFilter(filters.FilterSet):
     """
     Фильтрация рецептов по тегам,
-    избранному и списку покупок.
+    избранному и списку покупок, полнотекстовый поиск
+    и сортировка по популярности.
     """
 
     is_favorited = filters.BooleanFilter(
@@ -36,6 +39,15 @@ class RecipeFilter(filters.FilterSet):
         method='get_is_in_shopping_cart',
         label='shopping_cart',
     )
+    search = filters.CharFilter(
+        method='get_search',
+        label='search',
+    )
+    ordering = filters.ChoiceFilter(
+        method='get_ordering',
+        choices=[(value, value) for value in ORDERINGS],
+        label='ordering',
+    )
 
     def get_favorite(self, queryset, name, value):
         """
@@ -57,7 +69,25 @@ class RecipeFilter(filters.FilterSet):
             )
         return queryset
 
+    def get_search(self, queryset, name, value):
+        """
+        Поиск по названию, описанию и ингредиентам
+        с сортировкой по релевантности.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        return search(queryset, value).order_by(
+            '-search_rank', '-pub_date', '-id'
+        )
+
+    def get_ordering(self, queryset, name, value):
+        """
+        Сортировка по сохраненной оценке популярности.
+        """
+        return queryset.order_by(*ORDERINGS[value])
+
     class Meta:
         model = Recipe
-        fields = ('tags', 'author',
-                  'is_favorited', 'is_in_shopping_cart',)
+        fields = ('tags', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'search', 'ordering')
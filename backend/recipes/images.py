@@ -0,0 +1,151 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger('foodgram.images')
+
+VARIANTS_DIR = 'recipes/variants/'
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def supported_formats():
+    """
+    Форматы из настроек, которые умеет сохранять Pillow:
+    AVIF доступен только с соответствующим плагином.
+    """
+    Image.init()
+    return [
+        fmt for fmt in settings.RECIPE_IMAGE_FORMATS
+        if fmt.upper() in Image.SAVE
+    ]
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='recipe-images',
+            )
+        return _executor
+
+
+def schedule(recipe_id):
+    """
+    Подготовка вариантов картинки в пуле потоков
+    после фиксации транзакции.
+    """
+    transaction.on_commit(lambda: _submit(recipe_id))
+
+
+def _submit(recipe_id):
+    future = get_executor().submit(_run, recipe_id)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+
+
+def wait():
+    """
+    Ожидание завершения всех поставленных задач.
+    """
+    for future in list(_pending):
+        future.result()
+
+
+def _run(recipe_id):
+    close_old_connections()
+    try:
+        build_variants(recipe_id)
+    except Exception:
+        logger.exception('Не удалось подготовить картинки рецепта %s',
+                         recipe_id)
+    finally:
+        connection.close()
+
+
+def build_variants(recipe_id):
+    """
+    Уменьшенные копии картинки рецепта в форматах из настроек.
+    Результат записывается, только если картинка за это время
+    не сменилась; старые варианты удаляются.
+    """
+    row = Recipe.objects.filter(pk=recipe_id).values(
+        'image', 'image_variants'
+    ).first()
+    if row is None or not row['image']:
+        return
+    with default_storage.open(row['image']) as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    stem = os.path.splitext(os.path.basename(row['image']))[0]
+    variants = {}
+    for fmt in supported_formats():
+        variants[fmt] = {}
+        for width in settings.RECIPE_IMAGE_WIDTHS:
+            if width > original.width and variants[fmt]:
+                break
+            image = original.copy()
+            image.thumbnail((width, width * 4), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, fmt.upper(),
+                       quality=settings.RECIPE_IMAGE_QUALITY)
+            variants[fmt][str(image.width)] = default_storage.save(
+                f'{VARIANTS_DIR}{stem}-{image.width}.{fmt}',
+                ContentFile(buffer.getvalue()),
+            )
+    # Вместе с вариантами меняется версия кэша рецепта.
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=row['image']
+    ).update(image_variants=variants, cache_version=F('cache_version') + 1)
+    stale = row['image_variants'] if updated else variants
+    for names in stale.values():
+        for name in names.values():
+            default_storage.delete(name)
+
+
+def srcset(variants, build_url=None):
+    """
+    Строки srcset по форматам: "url 320w, url 640w".
+    """
+    build_url = build_url or (lambda url: url)
+    return {
+        fmt: ', '.join(
+            f'{build_url(default_storage.url(name))} {width}w'
+            for width, name in sorted(
+                names.items(), key=lambda item: int(item[0])
+            )
+        )
+        for fmt, names in variants.items()
+    }
+
+
+def absolute_srcset(value, request):
+    """
+    Абсолютные ссылки в srcset из закэшированного представления.
+    """
+    return {
+        fmt: ', '.join(
+            f'{request.build_absolute_uri(url)} {width}'
+            for url, width in (
+                candidate.rsplit(' ', 1) for candidate in line.split(', ')
+            )
+        ) if line else line
+        for fmt, line in value.items()
+    }
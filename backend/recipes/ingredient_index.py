@@ -0,0 +1,103 @@
+import bisect
+import json
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from foodgram_backend.db_router import primary_reads
+
+from .models import Ingredient
+from .serializers import IngredientSerializer
+
+VERSION_KEY = 'recipes:ingredient-index-version'
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса для поиска по началу
+    названия. Хранит отсортированные названия в casefold и готовые
+    JSON-фрагменты; перестраивается при смене версии в кэше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = ([], [])
+
+    def invalidate(self):
+        """
+        Смена версии индекса во всех процессах после фиксации
+        транзакции: иначе другой процесс успел бы перестроить
+        индекс по старым строкам и сохранить его под новой версией.
+        """
+        transaction.on_commit(self._bump_version)
+
+    def _bump_version(self):
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def _current_version(self):
+        return cache.get_or_set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def _rebuild(self, version):
+        entries = sorted(
+            (item['name'].casefold(), item['id'], json.dumps(
+                item, ensure_ascii=False, separators=(',', ':')
+            ).encode())
+            for item in IngredientSerializer(
+                Ingredient.objects.all(), many=True
+            ).data
+        )
+        self._entries = (
+            [key for key, _, _ in entries],
+            [fragment for _, _, fragment in entries],
+        )
+        self._version = version
+
+    def _ensure_fresh(self, version=None):
+        if version is None:
+            version = self._current_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    with primary_reads():
+                        self._rebuild(version)
+        return self._entries
+
+    def search(self, prefix=''):
+        """
+        JSON-фрагменты ингредиентов, название которых
+        начинается с prefix без учета регистра.
+        """
+        return self._match(self._ensure_fresh(), prefix)
+
+    def _match(self, entries, prefix):
+        keys, fragments = entries
+        prefix = prefix.casefold()
+        if not prefix:
+            return fragments
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_right(keys, prefix + chr(0x10FFFF), lo=start)
+        return fragments[start:end]
+
+    def render(self, prefix=''):
+        """
+        Готовое тело JSON-ответа со списком ингредиентов.
+        """
+        return b'[' + b','.join(self.search(prefix)) + b']'
+
+    async def arender(self, prefix=''):
+        """
+        Асинхронный вариант render: версия читается из кэша
+        асинхронно, перестройка индекса идет в синхронном потоке.
+        """
+        version = await cache.aget_or_set(VERSION_KEY, uuid.uuid4().hex, None)
+        if version == self._version:
+            entries = self._entries
+        else:
+            entries = await sync_to_async(self._ensure_fresh)(version)
+        return b'[' + b','.join(self._match(entries, prefix)) + b']'
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,118 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from recipes import images
+from recipes.benchmark import (BASELINE_PATH, BENCHMARK_SETTINGS, Context,
+                               compare, default_scenarios, run_scenario, seed)
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Замер количества SQL-запросов, задержек и размера
+    ответов для всех маршрутов API на синтетических данных.
+    Покрытие маршрутов сценариями и число SQL-запросов
+    проверяет тест tests/test_api_queries.py.
+    """
+
+    help = ('Регрессионный замер API: SQL-запросы, p50/p95 и размер '
+            'ответа в сравнении с эталоном')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--baseline', default=str(BASELINE_PATH))
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Записать результаты прогона как новый эталон',
+        )
+        parser.add_argument(
+            '--latency-tolerance', type=float, default=0.5,
+            help='Допустимый рост p50/p95 относительно эталона (доля)',
+        )
+        parser.add_argument(
+            '--latency-floor', type=float, default=10,
+            help='Рост задержки меньше этого значения (мс) не учитывается',
+        )
+        parser.add_argument(
+            '--size-tolerance', type=float, default=0.1,
+            help='Допустимый рост размера ответа (доля)',
+        )
+        parser.add_argument(
+            '--ignore-latency', action='store_true',
+            help='Сравнивать только SQL-запросы и размер ответа',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу после прогона',
+        )
+
+    def handle(self, *args, **options):
+        scenarios = default_scenarios()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        # Ожидаемые ответы 4xx не должны засорять вывод замеров.
+        logging.disable(logging.WARNING)
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                results = self.run(scenarios, options)
+        finally:
+            images.wait()
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb']
+            )
+
+        self.report(results)
+        errors = [
+            f'{r.name}: ответ {code}'
+            for r in results for code in r.statuses if code >= 500
+        ]
+        if options['update_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as f:
+                json.dump({r.name: r.as_dict() for r in results}, f,
+                          indent=2, ensure_ascii=False)
+                f.write('\n')
+            self.stdout.write(f'Эталон записан в {options["baseline"]}')
+        else:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            errors += compare(
+                results, baseline,
+                None if options['ignore_latency']
+                else options['latency_tolerance'],
+                options['size_tolerance'],
+                options['latency_floor'],
+            )
+        if errors:
+            raise CommandError('Регрессия:\n' + '\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
+
+    def run(self, scenarios, options):
+        if not Recipe.objects.exists():
+            self.stdout.write('Заполнение базы синтетическими данными...')
+            seed(users=options['users'], recipes=options['recipes'])
+        ctx = Context(options['repeat'])
+        results = []
+        for scenario in scenarios:
+            results.append(run_scenario(scenario, ctx, options['repeat']))
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"сценарий":<30}{"статус":>10}{"SQL":>6}'
+            f'{"p50, мс":>10}{"p95, мс":>10}{"байт":>10}'
+        )
+        for result in results:
+            data = result.as_dict()
+            statuses = ','.join(str(code) for code in sorted(result.statuses))
+            self.stdout.write(
+                f'{result.name:<30}{statuses:>10}{data["queries"]:>6}'
+                f'{data["p50_ms"]:>10}{data["p95_ms"]:>10}{data["bytes"]:>10}'
+            )
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager
+from importlib.util import find_spec
+from statistics import quantiles
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Ingredient, Recipe
+from rest_framework.authtoken.models import Token
+from users.models import CustomUser
+
+HOST = '127.0.0.1'
+# Сколько секунд ждать запуска сервера.
+STARTUP_TIMEOUT = 30
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    """
+    Пропускная способность маршрутов чтения на локальном
+    сервере: gunicorn с потоками (WSGI) против gunicorn
+    с воркерами uvicorn (ASGI, асинхронные вьюхи) при одновременных
+    медленных клиентах. Используется текущая база данных.
+    """
+
+    help = ('Сравнение пропускной способности WSGI и ASGI '
+            'под одновременной нагрузкой')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Потоков на воркер WSGI',
+        )
+        parser.add_argument(
+            '--clients', type=int, default=100,
+            help='Одновременных клиентов',
+        )
+        parser.add_argument(
+            '--duration', type=float, default=5,
+            help='Длительность замера одного маршрута (с)',
+        )
+        parser.add_argument(
+            '--slow-ms', type=float, default=50,
+            help='Пауза клиента перед концом заголовков запроса (мс)',
+        )
+
+    def handle(self, *args, **options):
+        for module in ('gunicorn', 'uvicorn'):
+            if find_spec(module) is None:
+                raise CommandError(f'Не установлен {module}')
+        routes = self.get_routes()
+        results = []
+        for name, async_views, command in self.servers(options):
+            port = free_port()
+            with self.serve(command(port), async_views, port):
+                for label, path, headers in routes:
+                    # Прогрев: кэш представлений и соединения воркеров.
+                    asyncio.run(self.load(
+                        port, path, headers, options['clients'],
+                        min(options['duration'], 1), 0,
+                    ))
+                    results.append((label, name, asyncio.run(self.load(
+                        port, path, headers, options['clients'],
+                        options['duration'], options['slow_ms'] / 1000,
+                    ))))
+        self.report(results)
+
+    def get_routes(self):
+        recipe_id = Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True).first()
+        if recipe_id is None:
+            raise CommandError(
+                'В базе нет рецептов: загрузите данные '
+                '(load_data, import_recipes)'
+            )
+        user = CustomUser.objects.order_by('-following_count', 'id').first()
+        token, _ = Token.objects.get_or_create(user=user)
+        name = Ingredient.objects.values_list('name', flat=True).first() or ''
+        return (
+            ('recipes-list', '/api/recipes/', {}),
+            ('recipes-detail', f'/api/recipes/{recipe_id}/', {}),
+            ('tags-list', '/api/tags/', {}),
+            ('ingredients-list',
+             f'/api/ingredients/?name={quote(name[:2])}', {}),
+            ('users-subscriptions', '/api/users/subscriptions/',
+             {'Authorization': f'Token {token.key}'}),
+        )
+
+    def servers(self, options):
+        def gunicorn(*extra):
+            return lambda port: [
+                sys.executable, '-m', 'gunicorn',
+                '--bind', f'{HOST}:{port}',
+                '--workers', str(options['workers']),
+                *extra,
+            ]
+
+        return (
+            ('WSGI', 'False', gunicorn(
+                '--worker-class', 'gthread',
+                '--threads', str(options['threads']),
+                'foodgram_backend.wsgi',
+            )),
+            ('ASGI', 'True', gunicorn(
+                '--worker-class', 'uvicorn.workers.UvicornWorker',
+                'foodgram_backend.asgi:application',
+            )),
+        )
+
+    @contextmanager
+    def serve(self, command, async_views, port):
+        env = {**os.environ, 'ASYNC_VIEWS': async_views}
+        with tempfile.TemporaryFile() as log:
+            process = subprocess.Popen(
+                command, cwd=settings.BASE_DIR, env=env,
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+            try:
+                self.wait_ready(process, port, log)
+                yield
+            finally:
+                process.terminate()
+                process.wait(timeout=STARTUP_TIMEOUT)
+
+    def wait_ready(self, process, port, log):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                urllib.request.urlopen(
+                    f'http://{HOST}:{port}/api/tags/', timeout=1
+                )
+                return
+            except OSError:
+                time.sleep(0.2)
+        log.seek(0)
+        raise CommandError(
+            'Сервер не запустился:\n'
+            + log.read()[-2000:].decode(errors='replace')
+        )
+
+    async def load(self, port, path, headers, clients, duration, slow):
+        """
+        clients клиентов по кругу отправляют запрос на новом
+        соединении; медленный клиент держит соединение slow секунд
+        до конца заголовков. Возвращает задержки успешных
+        ответов, число ошибок и время замера.
+        """
+        head = ''.join(
+            f'{name}: {value}\r\n' for name, value in {
+                'Host': f'{HOST}:{port}',
+                **headers,
+                'Connection': 'close',
+            }.items()
+        )
+        request = f'GET {path} HTTP/1.1\r\n{head}'.encode()
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started_at = time.perf_counter()
+                try:
+                    reader, writer = await asyncio.open_connection(HOST, port)
+                    try:
+                        writer.write(request)
+                        await writer.drain()
+                        await asyncio.sleep(slow)
+                        writer.write(b'\r\n')
+                        await writer.drain()
+                        response = await reader.read()
+                    finally:
+                        writer.close()
+                except OSError:
+                    response = b''
+                if response.startswith(b'HTTP/1.1 200'):
+                    latencies.append(time.perf_counter() - started_at)
+                else:
+                    errors += 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return latencies, errors, time.perf_counter() - started_at
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"маршрут":<22}{"сервер":>7}{"запр/с":>10}'
+            f'{"p50, мс":>10}{"p95, мс":>10}{"ошибки":>8}'
+        )
+        throughput = {}
+        for label, name, (latencies, errors, elapsed) in results:
+            rps = len(latencies) / elapsed
+            throughput[label, name] = rps
+            if len(latencies) > 1:
+                cuts = quantiles(latencies, n=100)
+                p50, p95 = cuts[49] * 1000, cuts[94] * 1000
+            else:
+                p50 = p95 = float('nan')
+            self.stdout.write(
+                f'{label:<22}{name:>7}{rps:>10.1f}'
+                f'{p50:>10.1f}{p95:>10.1f}{errors:>8}'
+            )
+        for label in dict.fromkeys(label for label, _, _ in results):
+            wsgi = throughput.get((label, 'WSGI'))
+            asgi = throughput.get((label, 'ASGI'))
+            if wsgi and asgi:
+                self.stdout.write(f'{label}: ASGI/WSGI {asgi / wsgi:.2f}x')
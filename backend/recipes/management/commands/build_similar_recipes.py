@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from recipes import similar
+
+
+class Command(BaseCommand):
+    """
+    Построение списков похожих рецептов. Списки рецептов, отмеченных
+    similar_stale, пересчитывает --stale; с --interval команда сама
+    повторяет пересчет (сервис similar в docker-compose).
+    """
+
+    help = 'Построение списков похожих рецептов по ингредиентам и тегам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='Пересчитать только списки, затронутые изменениями',
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='С --stale: повторять пересчет каждые N секунд, '
+                 'не завершаясь',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=similar.CHUNK_SIZE,
+            help='Сколько рецептов обрабатывать за одно умножение матриц',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Сверить сохраненные списки с расчетом, '
+                 'завершиться с ошибкой при расхождениях',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_lists()
+        if options['interval']:
+            if not options['stale']:
+                raise CommandError('--interval используется только с --stale')
+            while True:
+                close_old_connections()
+                try:
+                    self.refresh(options)
+                except Exception as error:
+                    self.stderr.write(
+                        f'Не удалось пересчитать похожие рецепты: {error}'
+                    )
+                time.sleep(options['interval'])
+        self.refresh(options)
+
+    def refresh(self, options):
+        started_at = time.perf_counter()
+        if options['stale']:
+            count = similar.refresh_stale()
+        else:
+            count = similar.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано списков: {count} '
+            f'за {time.perf_counter() - started_at:.1f} с'
+        ))
+
+    def check_lists(self):
+        wrong = similar.check()
+        if wrong:
+            raise CommandError(
+                f'Расхождения найдены: списки рецептов {wrong[:20]} '
+                f'(всего {len(wrong)}) расходятся с расчетом'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from recipes.transfer import export_lines
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка рецептов в формате NDJSON.
+    """
+
+    help = 'Выгрузка рецептов в формате NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help='Файл для выгрузки, по умолчанию стандартный вывод',
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file = (
+            open(path, 'w', encoding='utf-8') if path else sys.stdout
+        )
+        count = 0
+        try:
+            for line in export_lines(chunk_size=options['chunk_size']):
+                file.write(line)
+                count += 1
+        finally:
+            if path:
+                file.close()
+        self.stderr.write(self.style.SUCCESS(f'Выгружено рецептов: {count}'))
@@ -0,0 +1,62 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes.transfer import RecipeImporter
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Загрузка рецептов из NDJSON пачками. Ошибки отдельных
+    строк выводятся и не прерывают загрузку.
+    """
+
+    help = 'Загрузка рецептов из файла NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help='Файл NDJSON, по умолчанию стандартный ввод',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--author',
+            help='E-mail автора для рецептов, авторов которых нет в базе',
+        )
+
+    def on_error(self, line, errors):
+        self.stderr.write(
+            f'Строка {line}: {json.dumps(errors, ensure_ascii=False)}'
+        )
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            author = CustomUser.objects.filter(
+                email=options['author']
+            ).first()
+            if author is None:
+                raise CommandError(
+                    f'Пользователь не найден: {options["author"]}'
+                )
+        importer = RecipeImporter(
+            batch_size=options['batch_size'],
+            default_author=author,
+            on_error=self.on_error,
+        )
+        path = options['path']
+        try:
+            file = open(path, encoding='utf-8') if path else sys.stdin
+        except OSError as error:
+            raise CommandError(error)
+        try:
+            result = importer.run(file)
+        finally:
+            if path:
+                file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено: {result["created"]}, '
+            f'пропущено: {result["skipped"]}, '
+            f'с ошибками: {result["failed"]}'
+        ))
@@ -1,23 +1,116 @@
+import csv
 import json
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.ingredient_index import ingredient_index
 from recipes.models import Ingredient
 
+DEFAULT_PATH = settings.BASE_DIR / 'data' / 'ingredients.json'
+
+
+def iter_json(file, chunk_size=64 * 1024):
+    """
+    Потоковое чтение объектов из JSON-массива без загрузки
+    всего файла в память.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                row, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield row['name'], row['measurement_unit']
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise CommandError('Некорректный JSON: файл оборван')
+
+
+def iter_csv(file):
+    """
+    Строки CSV без заголовка: название, единица измерения.
+    """
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+READERS = {
+    '.json': iter_json,
+    '.csv': iter_csv,
+}
+
 
 class Command(BaseCommand):
     """
-    Заполнение ингредиентов из json файла.
+    Заполнение ингредиентов из json или csv файлов.
     """
 
-    help = 'Заполнение ингредиентов из json файла'
+    help = 'Заполнение ингредиентов из json или csv файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', default=[str(DEFAULT_PATH)],
+            help=f'Файлы .json или .csv, по умолчанию {DEFAULT_PATH}',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
 
-    def handle(self, *args, **kwargs):
-        with open('data/ingredients.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    def handle(self, *args, **options):
+        paths = [Path(path) for path in options['paths']]
+        for path in paths:
+            if path.suffix not in READERS:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+            if not path.exists():
+                raise CommandError(f'Файл не найден: {path}')
 
-        for row in data:
-            account = Ingredient(
-                name=row['name'],
-                measurement_unit=row['measurement_unit']
-            )
-            account.save()
+        existing = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        seen = set()
+        created = unchanged = 0
+        with transaction.atomic():
+            for path in paths:
+                with open(path, encoding='utf-8', newline='') as file:
+                    rows = READERS[path.suffix](file)
+                    while batch := list(islice(rows, options['batch_size'])):
+                        new = []
+                        for row in batch:
+                            if row in existing or row in seen:
+                                unchanged += 1
+                                continue
+                            seen.add(row)
+                            new.append(Ingredient(
+                                name=row[0], measurement_unit=row[1]
+                            ))
+                        Ingredient.objects.bulk_create(
+                            new, ignore_conflicts=True
+                        )
+                        created += len(new)
+                        self.stdout.write(
+                            f'{path.name}: обработано {created + unchanged}, '
+                            f'новых {created}'
+                        )
+        if created:
+            # bulk_create не отправляет сигналы post_save.
+            ingredient_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Новых ингредиентов: {created}, без изменений: {unchanged}'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    """
+    Перестроение лент подписок по подпискам пользователей.
+    """
+
+    help = 'Сверка лент подписок с подписками и исправление расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, завершиться с ошибкой при расхождениях',
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя; можно указать несколько раз',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            extra, missing = FeedEntry.objects.rebuild(
+                options['users'], dry_run=options['check']
+            )
+        summary = f'лишних записей: {extra}, недостающих записей: {missing}'
+        if options['check']:
+            if extra or missing:
+                raise CommandError(f'Расхождения найдены: {summary}')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Исправлено: {summary}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe
+from recipes.search import update_search_documents
+
+
+class Command(BaseCommand):
+    """
+    Пересчет поисковых документов всех рецептов.
+    """
+
+    help = 'Пересчет поисковых документов рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            for start in range(0, len(recipe_ids), batch_size):
+                update_search_documents(recipe_ids[start:start + batch_size])
+                self.stdout.write(
+                    f'обработано {min(start + batch_size, len(recipe_ids))}'
+                    f' из {len(recipe_ids)}'
+                )
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс обновлен'))
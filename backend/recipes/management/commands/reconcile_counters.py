@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    """
+    Пересчет счетчиков избранного, списков покупок,
+    рецептов и подписок.
+    """
+
+    help = 'Сверка счетчиков с данными и исправление расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, завершиться с ошибкой при расхождениях',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = reconcile(dry_run=options['check'])
+        for label, count in drift.items():
+            self.stdout.write(f'{label}: расхождений {count}')
+        if options['check'] and any(drift.values()):
+            raise CommandError('Счетчики расходятся с данными')
+        self.stdout.write(self.style.SUCCESS(
+            'Расхождений нет' if options['check'] else 'Счетчики пересчитаны'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes import rankings
+
+
+class Command(BaseCommand):
+    """
+    Сверка оценок популярности и рангов рецептов с избранным
+    и списками покупок.
+    """
+
+    help = ('Пересчет неверных оценок популярности по избранному '
+            'и спискам покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, завершиться с ошибкой при расхождениях',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            wrong = rankings.rebuild(dry_run=options['check'])
+        if not options['check']:
+            self.stdout.write(f'Исправлено неверных оценок: {wrong}')
+            return
+        if wrong:
+            raise CommandError(f'Расхождения найдены: неверных оценок {wrong}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -1,5 +1,61 @@
+import time
+
+from django.conf import settings
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models.functions import Greatest, RowNumber
+from foodgram_backend.db import insert_from_select
+from users.models import Follow
+
+# Ранг рецепта без оценки популярности (recipes.rankings): меньше
+# ранга любой оценки.
+NO_RANK = -1e6
+
+
+class RecipeQuerySet(models.QuerySet):
+    """
+    Выборки рецептов для сериализации.
+    """
+
+    def with_user_flags(self, user):
+        """
+        Флаги избранного, списка покупок и подписки на автора
+        для пользователя в виде подзапросов Exists.
+        """
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+                author_is_subscribed=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                user=user, author=models.OuterRef('author')
+            )),
+        )
+
+    def with_related(self):
+        """
+        Автор, теги и ингредиенты рецептов за фиксированное
+        число запросов.
+        """
+        return self.select_related('author').defer(
+            'search_document'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientsRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
 
 
 class Recipe(models.Model):
@@ -47,11 +103,91 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в список покупок',
+        default=0,
+        editable=False,
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    search_document = models.TextField(
+        verbose_name='Текст для поиска',
+        blank=True,
+        default='',
+        editable=False,
+    )
+    similar_stale = models.BooleanField(
+        verbose_name='Список похожих рецептов устарел',
+        default=True,
+        editable=False,
+    )
+    popular_score = models.FloatField(
+        verbose_name='Оценка популярности',
+        default=0,
+        editable=False,
+    )
+    trending_score = models.FloatField(
+        verbose_name='Оценка популярности за последние дни',
+        default=0,
+        editable=False,
+    )
+    # Ранги оценок для сортировки (recipes.rankings).
+    popular_rank = models.FloatField(
+        verbose_name='Ранг популярности',
+        default=NO_RANK,
+        editable=False,
+    )
+    trending_rank = models.FloatField(
+        verbose_name='Ранг популярности за последние дни',
+        default=NO_RANK,
+        editable=False,
+    )
+    # Unix-время, на которое посчитаны оценки (recipes.rankings).
+    ranked_at = models.FloatField(
+        verbose_name='Время расчета оценок',
+        default=time.time,
+        editable=False,
+    )
+    # Версия представления в кэше (recipes.cache).
+    cache_version = models.PositiveIntegerField(
+        verbose_name='Версия кэша',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=('-popular_rank', '-pub_date', '-id'),
+                name='recipe_popular_idx',
+            ),
+            models.Index(
+                fields=('-trending_rank', '-pub_date', '-id'),
+                name='recipe_trending_idx',
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -175,6 +311,12 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='shopping_cart'
     )
+    # Unix-время: от него считается вклад в оценки рецепта.
+    added_at = models.FloatField(
+        verbose_name='Время добавления',
+        default=time.time,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -202,6 +344,12 @@ class FavoriteRecipe(models.Model):
         on_delete=models.CASCADE,
         related_name='favorite_recipes'
     )
+    # Unix-время: от него считается вклад в оценки рецепта.
+    added_at = models.FloatField(
+        verbose_name='Время добавления',
+        default=time.time,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -212,3 +360,384 @@ class FavoriteRecipe(models.Model):
                 name='unique_favorite'
             )
         ]
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """
+    Поддержание сводного списка покупок.
+    """
+
+    def recipe_amounts(self, recipe_ids):
+        """
+        Количество каждого ингредиента в рецептах.
+        """
+        return dict(
+            IngredientsRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('ingredient_id').annotate(
+                total=models.Sum('amount')
+            ).order_by()
+        )
+
+    def apply_deltas(self, user_ids, deltas):
+        """
+        Изменение количеств ингредиентов у пользователей на deltas
+        тремя запросами независимо от числа ингредиентов.
+        """
+        user_ids = list(user_ids)
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not user_ids or not deltas:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=0)
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True,
+        )
+        self.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        ).update(amount=Greatest(
+            models.F('amount') + models.Case(
+                *(models.When(ingredient_id=pk, then=models.Value(delta))
+                  for pk, delta in deltas.items()),
+                default=models.Value(0),
+            ),
+            models.Value(0),
+        ))
+        if any(delta < 0 for delta in deltas.values()):
+            self.filter(
+                user_id__in=user_ids, ingredient_id__in=deltas, amount=0
+            ).delete()
+
+    def apply_row_changes(self, before, after):
+        """
+        Изменение списков покупок на разницу строк ингредиентов
+        рецептов: before и after - количества по парам
+        (id рецепта, id ингредиента) до и после изменения.
+        """
+        deltas = {}
+        for recipe_id, ingredient_id in before.keys() | after.keys():
+            delta = (after.get((recipe_id, ingredient_id), 0)
+                     - before.get((recipe_id, ingredient_id), 0))
+            if delta:
+                deltas.setdefault(recipe_id, {})[ingredient_id] = delta
+        for recipe_id, recipe_deltas in deltas.items():
+            self.apply_deltas(
+                ShoppingCart.objects.filter(
+                    recipe_id=recipe_id
+                ).values_list('user_id', flat=True),
+                recipe_deltas,
+            )
+
+    def add_recipes(self, user, recipe_ids):
+        self.apply_deltas([user.pk], self.recipe_amounts(recipe_ids))
+
+    def remove_recipes(self, user, recipe_ids):
+        self.apply_deltas([user.pk], {
+            pk: -amount
+            for pk, amount in self.recipe_amounts(recipe_ids).items()
+        })
+
+    def expected(self, user_ids=None):
+        """
+        Сводный список покупок, посчитанный по корзинам.
+        """
+        rows = IngredientsRecipe.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(recipe__shopping_cart__user_id__in=user_ids)
+        return {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in rows.values_list(
+                'recipe__shopping_cart__user_id', 'ingredient_id'
+            ).annotate(
+                total=models.Sum('amount')
+            ).exclude(
+                recipe__shopping_cart__user_id=None
+            ).order_by()
+        }
+
+    def rebuild(self, user_ids=None, dry_run=False):
+        """
+        Сверка таблицы с корзинами и исправление расхождений.
+        Возвращает количество лишних, неверных и недостающих строк.
+        """
+        expected = self.expected(user_ids)
+        rows = self.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): (pk, amount)
+            for pk, user_id, ingredient_id, amount in rows.values_list(
+                'pk', 'user_id', 'ingredient_id', 'amount'
+            )
+        }
+        extra = [pk for key, (pk, _) in actual.items() if key not in expected]
+        wrong = [
+            self.model(pk=actual[key][0], amount=amount)
+            for key, amount in expected.items()
+            if key in actual and actual[key][1] != amount
+        ]
+        missing = [
+            self.model(user_id=user_id, ingredient_id=ingredient_id,
+                       amount=amount)
+            for (user_id, ingredient_id), amount in expected.items()
+            if (user_id, ingredient_id) not in actual
+        ]
+        if not dry_run:
+            self.filter(pk__in=extra).delete()
+            self.bulk_update(wrong, ['amount'], batch_size=1000)
+            self.bulk_create(missing, batch_size=1000)
+        return len(extra), len(wrong), len(missing)
+
+
+class ShoppingCartIngredient(models.Model):
+    """
+    Сводный список покупок: суммарное количество каждого
+    ингредиента по всем рецептам в корзине пользователя.
+    """
+
+    user = models.ForeignKey(
+        'users.CustomUser',
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients'
+    )
+    amount = models.PositiveIntegerField(
+        default=0,
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient'
+            )
+        ]
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    """
+    Поддержание лент подписок. Рецепт при публикации рассылается
+    в ленты подписчиков автора, лента хранит FEED_SIZE последних
+    записей. Рецепты авторов, у которых не меньше FEED_FANOUT_LIMIT
+    подписчиков, не рассылаются и читаются при запросе ленты.
+    """
+
+    def entries(self, follows):
+        """
+        Строки ленты (пользователь, рецепт, автор, дата публикации)
+        по подпискам follows, отфильтрованным по рецептам автора.
+        """
+        return follows.filter(
+            author__followers_count__lt=settings.FEED_FANOUT_LIMIT
+        ).values_list(
+            'user_id', 'author__recipes__id', 'author_id',
+            'author__recipes__pub_date',
+        )
+
+    def insert(self, entries):
+        return insert_from_select(
+            self.model, ('user', 'recipe', 'author', 'pub_date'), entries
+        )
+
+    def fan_out(self, recipe_ids):
+        """
+        Рассылка новых рецептов в ленты подписчиков
+        их авторов одним INSERT ... SELECT.
+        """
+        follows = Follow.objects.filter(author__recipes__in=recipe_ids)
+        if self.insert(self.entries(follows)):
+            self.trim(follows.values('user_id'))
+
+    def follow(self, user_id, author_id):
+        """
+        Заполнение ленты последними рецептами автора после подписки.
+        """
+        entries = self.entries(Follow.objects.filter(
+            user_id=user_id, author_id=author_id,
+            author__recipes__isnull=False,
+        )).order_by(
+            '-author__recipes__pub_date', '-author__recipes__id'
+        )[:settings.FEED_SIZE]
+        if self.insert(entries):
+            self.trim([user_id])
+
+    def unfollow(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+    def trim(self, user_ids):
+        """
+        Удаление из лент пользователей записей
+        старше FEED_SIZE последних.
+        """
+        extra = self.filter(user_id__in=user_ids).annotate(
+            position=models.Window(
+                RowNumber(),
+                partition_by=models.F('user_id'),
+                order_by=(models.F('pub_date').desc(),
+                          models.F('recipe_id').desc()),
+            )
+        ).filter(position__gt=settings.FEED_SIZE)
+        self.filter(pk__in=extra.values('pk')).delete()
+
+    def timeline(self, user):
+        """
+        Лента пользователя: пары (рецепт, дата публикации), новые
+        первыми. Без авторов, которые читаются при запросе, это
+        один проход по индексу ленты пользователя.
+        """
+        timeline = self.filter(user=user).values_list(
+            'recipe_id', 'pub_date'
+        ).order_by()
+        pulled = list(Follow.objects.filter(
+            user=user,
+            author__followers_count__gte=settings.FEED_FANOUT_LIMIT,
+        ).values_list('author_id', flat=True))
+        if pulled:
+            # UNION убирает рецепты, разосланные до того,
+            # как у автора стало много подписчиков.
+            timeline = timeline.union(Recipe.objects.filter(
+                author__in=pulled
+            ).values_list('id', 'pub_date').order_by())
+        return timeline.order_by('-pub_date', '-recipe_id')
+
+    def expected(self, user_ids=None):
+        """
+        Ленты, посчитанные по подпискам: FEED_SIZE
+        последних записей каждого пользователя.
+        """
+        follows = Follow.objects.filter(author__recipes__isnull=False)
+        if user_ids is not None:
+            follows = follows.filter(user_id__in=user_ids)
+        feeds = {}
+        for entry in self.entries(follows).order_by(
+            'user_id', '-author__recipes__pub_date', '-author__recipes__id'
+        ):
+            feed = feeds.setdefault(entry[0], [])
+            if len(feed) < settings.FEED_SIZE:
+                feed.append(entry)
+        return {
+            (user_id, recipe_id): (author_id, pub_date)
+            for feed in feeds.values()
+            for user_id, recipe_id, author_id, pub_date in feed
+        }
+
+    def rebuild(self, user_ids=None, dry_run=False):
+        """
+        Сверка лент с подписками и исправление расхождений.
+        Возвращает количество лишних и недостающих записей.
+        """
+        expected = self.expected(user_ids)
+        rows = self.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, recipe_id): pk
+            for pk, user_id, recipe_id in rows.values_list(
+                'pk', 'user_id', 'recipe_id'
+            )
+        }
+        extra = [pk for key, pk in actual.items() if key not in expected]
+        missing = [
+            self.model(user_id=user_id, recipe_id=recipe_id,
+                       author_id=author_id, pub_date=pub_date)
+            for (user_id, recipe_id), (author_id, pub_date)
+            in expected.items() if (user_id, recipe_id) not in actual
+        ]
+        if not dry_run:
+            self.filter(pk__in=extra).delete()
+            self.bulk_create(missing, batch_size=1000)
+        return len(extra), len(missing)
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан
+    пользователь. Автор и дата публикации скопированы из рецепта,
+    чтобы лента выбиралась одним проходом по индексу.
+    """
+
+    user = models.ForeignKey(
+        'users.CustomUser',
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        'users.CustomUser',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx',
+            ),
+        )
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт по общим ингредиентам и тегам (мера Жаккара).
+    Списки строит команда build_similar_recipes, после изменения
+    рецептов их пересчитывает build_similar_recipes --stale.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
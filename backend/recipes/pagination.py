@@ -1,9 +1,174 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорный паджинатор без OFFSET и COUNT(*). Позиция курсора -
+    значения всех полей сортировки, а не только первого, как
+    в CursorPagination: последнее поле (id) уникально, поэтому
+    рецепты с одинаковой оценкой или датой не повторяются
+    и не пропускаются между страницами.
+    """
+
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        CursorPagination.paginate_queryset с отбором строк после
+        позиции по всем полям сортировки.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+        ordering = (_reverse_ordering(self.ordering) if reverse
+                    else self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = self.after(queryset, ordering, current_position)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after(self, queryset, ordering, position):
+        """
+        Строки после позиции в порядке ordering: сравнение
+        кортежей значений полей. Нестрогое условие на первое поле
+        повторяется отдельно, чтобы поиск начинался по индексу.
+        """
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError
+            fields = [
+                (order.lstrip('-'), 'lt' if order.startswith('-') else 'gt')
+                for order in ordering
+            ]
+            condition = None
+            for (field, lookup), value in reversed(list(zip(fields, values))):
+                step = Q(**{f'{field}__{lookup}': value})
+                if condition is not None:
+                    step |= Q(**{field: value}) & condition
+                condition = step
+            first, lookup = fields[0]
+            return queryset.filter(
+                Q(**{f'{first}__{lookup}e': values[0]}), condition
+            )
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            value = getattr(instance, order.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return json.dumps(values)
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     """
     Кастомный паджинатор.
+    При наличии параметра cursor переключается на курсорную
+    паджинацию, порядок задается атрибутом cursor_ordering вьюсета.
+    Списки, не являющиеся QuerySet, всегда делятся на страницы.
     """
 
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (self.cursor_query_param not in request.query_params
+                or not isinstance(queryset, QuerySet)):
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination()
+        self.keyset.ordering = getattr(
+            view, 'cursor_ordering', KeysetPagination.ordering
+        )
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Асинхронный вариант paginate_queryset: COUNT и страница
+        выбираются асинхронным ORM, курсорная паджинация
+        выполняется в синхронном потоке.
+        """
+        if not isinstance(queryset, QuerySet):
+            return self.paginate_queryset(queryset, request, view)
+        if self.cursor_query_param in request.query_params:
+            return await sync_to_async(self.paginate_queryset)(
+                queryset, request, view
+            )
+        self.keyset = None
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # count - cached_property, Paginator берет готовое значение.
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        self.page.object_list = [
+            item async for item in self.page.object_list
+        ]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(CustomPageNumberPagination):
+    """
+    Паджинатор ленты подписок: лента ограничена FEED_SIZE
+    записями, поэтому COUNT и OFFSET в ней дешевые
+    и курсор не нужен.
+    """
+
+    cursor_query_param = None
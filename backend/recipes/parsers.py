@@ -0,0 +1,15 @@
+from rest_framework.parsers import BaseParser
+
+from .transfer import CONTENT_TYPE
+
+
+class NDJSONParser(BaseParser):
+    """
+    Тело запроса в формате NDJSON отдается итератором строк
+    и читается из потока по мере загрузки.
+    """
+
+    media_type = CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return iter(stream) if stream is not None else iter(())
@@ -0,0 +1,198 @@
+"""
+Оценки популярности рецептов для сортировки ordering=popular
+и ordering=trending: добавления в избранное и в список покупок
+с экспоненциальным затуханием - вклад добавления убывает вдвое
+за период полураспада.
+
+Оценки хранятся на момент ranked_at рецепта и меняются тем же
+UPDATE, что и счетчики: оценка приводится к текущему моменту,
+к ней прибавляется вклад добавления или вычитается вклад
+удаленной строки. Сортировка идет по рангу - логарифму оценки,
+приведенной к началу эпохи Unix. Затухание одинаково для всех
+рецептов, поэтому порядок рангов совпадает с порядком оценок
+на любой момент, а ранг меняется только при добавлении
+и удалении: курсор страницы не сдвигается со временем.
+"""
+import math
+import time
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import (Case, F, FloatField, OuterRef, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Abs, Coalesce, Greatest, Ln, Power
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+
+from .models import NO_RANK, FavoriteRecipe, Recipe, ShoppingCart
+
+DAY = 24 * 60 * 60
+# Порядок рецептов по значению параметра ordering.
+ORDERINGS = {
+    'popular': ('-popular_rank', '-pub_date', '-id'),
+    'trending': ('-trending_rank', '-pub_date', '-id'),
+}
+# Поле ранга для каждого поля оценки.
+RANKS = {'popular_score': 'popular_rank', 'trending_score': 'trending_rank'}
+# Вес одного добавления в оценке.
+WEIGHTS = {FavoriteRecipe: 1.0, ShoppingCart: 1.0}
+# Множитель затухания не меньше 2 ** MIN_EXPONENT, оценки меньше
+# MIN_SCORE обнуляются: на денормализованных числах PostgreSQL
+# выдает ошибку underflow.
+MIN_EXPONENT = -60.0
+MIN_SCORE = 1e-6
+# Допустимое относительное расхождение оценки с пересчетом.
+TOLERANCE = 1e-6
+
+
+def half_lives():
+    """
+    Период полураспада в секундах для каждого поля оценки.
+    """
+    return {
+        'popular_score': settings.POPULAR_HALF_LIFE_DAYS * DAY,
+        'trending_score': settings.TRENDING_HALF_LIFE_DAYS * DAY,
+    }
+
+
+def decay(since, now, half_life):
+    """
+    Множитель затухания от момента since (выражение) до now.
+    """
+    return Power(Value(2.0), Greatest(
+        (since - Value(now)) / Value(half_life), Value(MIN_EXPONENT)
+    ))
+
+
+def contribution(model, added_at, now, half_life):
+    """
+    Вклад строки model, добавленной в added_at, в оценку на момент now.
+    """
+    return WEIGHTS[model] * 2 ** max((added_at - now) / half_life,
+                                     MIN_EXPONENT)
+
+
+def rounded(score):
+    return Case(
+        When(GreaterThanOrEqual(score, Value(MIN_SCORE)), then=score),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def rank(score, now, half_life):
+    """
+    Ранг оценки score на момент now: log2 оценки, приведенной
+    к началу эпохи Unix.
+    """
+    return Case(
+        When(GreaterThanOrEqual(score, Value(MIN_SCORE)),
+             then=Ln(score) / Value(math.log(2)) + Value(now / half_life)),
+        default=Value(NO_RANK),
+        output_field=FloatField(),
+    )
+
+
+def rank_score(field, now, half_life):
+    """
+    Оценка field на момент now, восстановленная по рангу.
+    """
+    return Power(Value(2.0), Greatest(
+        F(RANKS[field]) - Value(now / half_life),
+        Value(MIN_EXPONENT),
+    ))
+
+
+def score_updates(now, change):
+    """
+    Поля UPDATE рецептов: оценки и ранги на момент now, измененные
+    на change(half_life).
+    """
+    updates = {'ranked_at': Value(now)}
+    for field, half_life in half_lives().items():
+        score = (F(field) * decay(F('ranked_at'), now, half_life)
+                 + change(half_life))
+        updates[field] = rounded(score)
+        updates[RANKS[field]] = rank(score, now, half_life)
+    return updates
+
+
+def added(model, now):
+    """
+    Поля UPDATE рецептов после добавления в model в момент now.
+    """
+    return score_updates(now, lambda half_life: Value(WEIGHTS[model]))
+
+
+def removed(model, rows, now):
+    """
+    Поля UPDATE рецептов после удаления строк model;
+    rows - пары (id рецепта, время добавления удаленной строки).
+    """
+    return score_updates(now, lambda half_life: Case(
+        *(When(pk=recipe_id, then=Value(
+            -contribution(model, added_at, now, half_life)
+        )) for recipe_id, added_at in rows),
+        default=Value(0.0),
+        output_field=FloatField(),
+    ))
+
+
+def actual_score(now, half_life):
+    """
+    Оценка на момент now, посчитанная по строкам
+    избранного и списков покупок.
+    """
+    return sum(
+        Coalesce(
+            Subquery(
+                model.objects.filter(
+                    recipe=OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    total=Sum(weight * decay(F('added_at'), now, half_life))
+                ).values('total')
+            ),
+            Value(0.0),
+        )
+        for model, weight in WEIGHTS.items()
+    )
+
+
+def rebuild(dry_run=False):
+    """
+    Сверка оценок и рангов с пересчетом по строкам избранного
+    и списков покупок и исправление расхождений. Возвращает число
+    рецептов с неверными оценками.
+    """
+    now = time.time()
+    actual = {
+        field: actual_score(now, half_life)
+        for field, half_life in half_lives().items()
+    }
+    stored = {}
+    for field, half_life in half_lives().items():
+        stored[f'current_{field}'] = (
+            F(field) * decay(F('ranked_at'), now, half_life)
+        )
+        stored[f'ranked_{field}'] = rank_score(field, now, half_life)
+    wrong = Recipe.objects.annotate(**{
+        f'actual_{field}': score
+        for field, score in actual.items()
+    }, **stored).filter(reduce(or_, (
+        GreaterThan(
+            Abs(F(f'{kind}_{field}') - F(f'actual_{field}')),
+            F(f'actual_{field}') * TOLERANCE + MIN_SCORE,
+        )
+        for field in actual for kind in ('current', 'ranked')
+    )))
+    count = wrong.count()
+    if count and not dry_run:
+        Recipe.objects.filter(pk__in=wrong.values('pk')).update(
+            ranked_at=Value(now),
+            **{field: rounded(score) for field, score in actual.items()},
+            **{
+                RANKS[field]: rank(actual[field], now, half_life)
+                for field, half_life in half_lives().items()
+            },
+        )
+    return count
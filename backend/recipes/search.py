@@ -0,0 +1,179 @@
+import re
+from collections import defaultdict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models
+
+from .models import IngredientsRecipe, Recipe
+
+# Конфигурация полнотекстового поиска PostgreSQL.
+CONFIG = 'russian'
+INDEX_NAME = 'recipe_search_document_idx'
+FTS_TABLE = 'recipes_recipe_fts'
+SEARCH_VENDORS = ('postgresql', 'sqlite')
+WORD = re.compile(r'\w+')
+
+
+class TsVector(models.Func):
+    """
+    to_tsvector с фиксированной конфигурацией: выражение
+    совпадает с выражением GIN-индекса.
+    """
+
+    function = 'to_tsvector'
+    template = f"%(function)s('{CONFIG}'::regconfig, %(expressions)s)"
+    output_field = models.TextField()
+
+
+class TsQuery(models.Func):
+    function = 'to_tsquery'
+    template = f"%(function)s('{CONFIG}'::regconfig, %(expressions)s)"
+    output_field = models.TextField()
+
+
+class TsMatch(models.Func):
+    template = '%(expressions)s'
+    arg_joiner = ' @@ '
+    output_field = models.BooleanField()
+
+
+class TsRank(models.Func):
+    function = 'ts_rank'
+    output_field = models.FloatField()
+
+
+def build_document(name, text, ingredients):
+    return '\n'.join((name, text, *ingredients))
+
+
+def update_search_documents(recipe_ids):
+    """
+    Пересчет поискового документа рецептов: название,
+    описание и названия ингредиентов. bulk_update не отправляет
+    сигналы, на SQLite таблицу FTS5 обновляют триггеры.
+    """
+    ingredients = defaultdict(list)
+    for recipe_id, name in IngredientsRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient__name').order_by('id'):
+        ingredients[recipe_id].append(name)
+    Recipe.objects.bulk_update(
+        [
+            Recipe(pk=pk, search_document=build_document(
+                name, text, ingredients[pk]
+            ))
+            for pk, name, text in Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).values_list('pk', 'name', 'text')
+        ],
+        ['search_document'],
+        batch_size=500,
+    )
+
+
+def query_words(query):
+    """
+    Слова запроса; спецсимволы синтаксиса отбрасываются.
+    """
+    return WORD.findall(query.lower())
+
+
+def fts5_query(words):
+    """
+    Запрос FTS5: все слова обязательны, каждое ищется как префикс.
+    """
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def tsquery_text(words):
+    """
+    Запрос to_tsquery с той же семантикой, что и в FTS5:
+    все слова обязательны, каждое ищется как префикс.
+    """
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search(queryset, query):
+    """
+    Рецепты, подходящие под запрос, с аннотацией search_rank
+    для сортировки по релевантности.
+    """
+    words = query_words(query)
+    if not words:
+        return queryset.annotate(search_rank=models.Value(0.0)).none()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        vector = TsVector(models.F('search_document'))
+        tsquery = TsQuery(models.Value(tsquery_text(words)))
+        return queryset.annotate(
+            search_rank=TsRank(vector, tsquery)
+        ).filter(TsMatch(vector, tsquery))
+    # SQLite: другие СУБД не проходят require_search_backend.
+    table = Recipe._meta.db_table
+    return queryset.extra(
+        select={'search_rank': f'-bm25({FTS_TABLE})'},
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = "{table}"."id"',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[fts5_query(words)],
+    )
+
+
+def require_search_backend():
+    """
+    Полнотекстовый поиск есть только на PostgreSQL и SQLite:
+    с другими СУБД приложение не запускается.
+    """
+    for alias in connections:
+        vendor = connections[alias].vendor
+        if vendor not in SEARCH_VENDORS:
+            raise ImproperlyConfigured(
+                f'Поиск рецептов не поддерживает СУБД {vendor} '
+                f'(база {alias}): используйте PostgreSQL или SQLite.'
+            )
+
+
+def install(using='default', **kwargs):
+    """
+    Создание индекса для поиска после migrate: GIN-индекс по
+    выражению на PostgreSQL, таблица FTS5 с триггерами на SQLite.
+    """
+    connection = connections[using]
+    table = Recipe._meta.db_table
+    if table not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} '
+                f"USING gin (to_tsvector('{CONFIG}'::regconfig, "
+                f'search_document))'
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING '
+                f"fts5(search_document, content='{table}', "
+                f"content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            delete = (
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "
+                f"search_document) VALUES ('delete', old.id, "
+                f'old.search_document);'
+            )
+            insert = (
+                f'INSERT INTO {FTS_TABLE}(rowid, search_document) '
+                f'VALUES (new.id, new.search_document);'
+            )
+            for name, event, body in (
+                ('ai', 'AFTER INSERT', insert),
+                ('ad', 'AFTER DELETE', delete),
+                ('au', 'AFTER UPDATE OF search_document', delete + insert),
+            ):
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{name} '
+                    f'{event} ON {table} BEGIN {body} END'
+                )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+            )
@@ -1,12 +1,32 @@
+import json
+
 from django.core.validators import MinValueValidator
 from django.db import transaction
-from drf_extra_fields.fields import Base64ImageField
+from django.http import QueryDict
 from rest_framework import exceptions, serializers
 from rest_framework.exceptions import ValidationError
 
+from users.models import CustomUser
 from users.serializers import CustomUserSerializer
-from .models import (FavoriteRecipe, Ingredient, IngredientsRecipe, Recipe,
-                     ShoppingCart, Tag)
+from .cookable import MAX_MISSING, cookable_index
+from .counters import change_counter
+from .fields import RecipeImageField
+from .images import schedule, srcset
+from .models import (FavoriteRecipe, FeedEntry, Ingredient, IngredientsRecipe,
+                     Recipe, ShoppingCart, ShoppingCartIngredient, Tag)
+from .search import update_search_documents
+
+
+def get_image_srcset(serializer, obj):
+    """
+    Уменьшенные копии картинки в формате srcset по форматам;
+    пустой словарь, пока копии не готовы.
+    """
+    request = serializer.context.get('request')
+    return srcset(
+        obj.image_variants,
+        request.build_absolute_uri if request else None,
+    )
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -96,12 +116,15 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField(
         method_name='get_is_in_shopping_cart'
     )
+    image_srcset = serializers.SerializerMethodField(
+        method_name='get_image_srcset'
+    )
 
     def get_ingredients(self, obj):
         """
         Получение ингредиентов рецепта.
         """
-        ingredients = IngredientsRecipe.objects.filter(recipe=obj)
+        ingredients = obj.recipe_ingredients.all()
         serializer = IngredientsRecipeSerializer(ingredients, many=True)
         return serializer.data
 
@@ -109,6 +132,9 @@ class RecipeSerializer(serializers.ModelSerializer):
         """
         Получение избранных рецептов.
         """
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -118,16 +144,33 @@ class RecipeSerializer(serializers.ModelSerializer):
         """
         Получение рецептов из списка покупок.
         """
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         user = self.context['request'].user
         if user.is_anonymous:
             return False
         return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
 
+    def get_image_srcset(self, obj):
+        return get_image_srcset(self, obj)
+
+    def to_representation(self, instance):
+        """
+        Флаг подписки на автора из аннотации рецепта.
+        """
+        is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
+
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'image_srcset', 'text', 'cooking_time',
+                  'favorites_count')
+        read_only_fields = ('favorites_count',)
 
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
@@ -145,7 +188,7 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     ingredients = CreateUpdateIngredientsRecipeSerializer(
         many=True
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     cooking_time = serializers.IntegerField(
@@ -157,6 +200,49 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         )
     )
 
+    def to_internal_value(self, data):
+        """
+        В multipart/form-data картинка передается файлом, теги -
+        повторяющимся полем или JSON-списком, ингредиенты -
+        JSON-списком.
+        """
+        if isinstance(data, QueryDict):
+            data = self.parse_multipart(data)
+        return super().to_internal_value(data)
+
+    def run_validation(self, data=serializers.empty):
+        """
+        При ошибке в любом поле временный файл картинки
+        удаляется сразу, а не при сборке мусора.
+        """
+        try:
+            return super().run_validation(data)
+        except ValidationError:
+            self.fields['image'].discard()
+            raise
+
+    def parse_multipart(self, data):
+        parsed = {key: data.get(key) for key in data}
+        tags = data.getlist('tags')
+        if len(tags) == 1 and tags[0].lstrip().startswith('['):
+            tags = self.parse_json_list('tags', tags[0])
+        if tags:
+            parsed['tags'] = tags
+        if 'ingredients' in data:
+            parsed['ingredients'] = self.parse_json_list(
+                'ingredients', data.get('ingredients')
+            )
+        return parsed
+
+    def parse_json_list(self, name, value):
+        try:
+            value = json.loads(value)
+        except (TypeError, ValueError):
+            value = None
+        if not isinstance(value, list):
+            raise ValidationError({name: 'Ожидается JSON-список.'})
+        return value
+
     def validate_tags(self, value):
         """
         Валидация тегов.
@@ -181,8 +267,28 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise ValidationError(
                 'Ингредиенты в рецепте должны быть уникальными!'
             )
+        missing = set(ingredients) - Ingredient.objects.in_bulk(
+            ingredients
+        ).keys()
+        if missing:
+            raise ValidationError(
+                'Ингредиенты не найдены: '
+                + ', '.join(map(str, sorted(missing)))
+            )
         return value
 
+    def save(self, **kwargs):
+        """
+        Временный файл картинки закрывается после сохранения:
+        хранилище перемещает его, а не копирует.
+        """
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
     @transaction.atomic
     def create(self, validated_data):
         """
@@ -193,40 +299,105 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=author, **validated_data)
         recipe.tags.set(tags)
+        schedule(recipe.pk)
+        change_counter(CustomUser.objects.filter(pk=author.pk),
+                       'recipes_count', 1)
+        FeedEntry.objects.fan_out([recipe.pk])
 
         IngredientsRecipe.objects.bulk_create(
             [IngredientsRecipe(
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 recipe=recipe,
                 amount=ingredient['amount']
-            )for ingredient in ingredients])
+            ) for ingredient in ingredients])
+        update_search_documents([recipe.pk])
+        cookable_index.mark_changed([recipe.pk])
         return recipe
 
+    def set_ingredients(self, recipe, ingredients):
+        """
+        Запись ингредиентов рецепта по разнице с текущими:
+        вставляются, изменяются и удаляются только отличающиеся
+        строки. Возвращает изменения количеств по ингредиентам
+        и признак изменения состава.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        current = {
+            row.ingredient_id: row
+            for row in recipe.recipe_ingredients.only(
+                'id', 'recipe_id', 'ingredient_id', 'amount'
+            )
+        }
+        deltas = {}
+        changed = []
+        removed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id, 0)
+            if amount == row.amount:
+                continue
+            deltas[ingredient_id] = amount - row.amount
+            if amount:
+                row.amount = amount
+                changed.append(row)
+            else:
+                removed.append(row.pk)
+        added = [
+            IngredientsRecipe(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in amounts.items() if pk not in current
+        ]
+        deltas.update((row.ingredient_id, row.amount) for row in added)
+        if removed:
+            IngredientsRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientsRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientsRecipe.objects.bulk_create(added)
+        return deltas, bool(removed or added)
+
     @transaction.atomic
     def update(self, instance, validated_data):
         """
-        Изменение рецепта.
+        Изменение рецепта, в том числе частичное. Списки покупок
+        пользователей, у которых рецепт в корзине, меняются
+        на разницу в ингредиентах.
         """
         tags = validated_data.pop('tags', None)
-        instance.tags.set(tags)
+        if tags is not None:
+            instance.tags.set(tags)
         ingredients = validated_data.pop('ingredients', None)
-        instance.ingredients.clear()
-
-        IngredientsRecipe.objects.bulk_create(
-            [IngredientsRecipe(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
-                amount=ingredient['amount']
-            )for ingredient in ingredients])
-        return super().update(instance, validated_data)
+        composition_changed = False
+        if ingredients is not None:
+            deltas, composition_changed = self.set_ingredients(
+                instance, ingredients
+            )
+            if deltas:
+                ShoppingCartIngredient.objects.apply_deltas(
+                    instance.shopping_cart.values_list('user_id', flat=True),
+                    deltas,
+                )
+        if 'image' in validated_data:
+            schedule(instance.pk)
+        similar_changed = composition_changed or tags is not None
+        if similar_changed:
+            instance.similar_stale = True
+        instance = super().update(instance, validated_data)
+        if composition_changed or {'name', 'text'} & validated_data.keys():
+            update_search_documents([instance.pk])
+        if composition_changed:
+            cookable_index.mark_changed([instance.pk])
+        return instance
 
     def to_representation(self, instance):
         """
         Отображение рецепта после создания или изменения.
         """
+        request = self.context.get('request')
+        instance = Recipe.objects.with_user_flags(
+            request.user
+        ).with_related().get(pk=instance.pk)
         serializer = RecipeSerializer(
             instance,
-            context={'request': self.context.get('request')}
+            context={'request': request}
         )
         return serializer.data
 
@@ -242,6 +413,82 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
     Получение краткой версии рецепта.
     """
 
+    image_srcset = serializers.SerializerMethodField(
+        method_name='get_image_srcset'
+    )
+
+    def get_image_srcset(self, obj):
+        return get_image_srcset(self, obj)
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time')
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    """
+    Параметры поиска рецептов по имеющимся ингредиентам.
+    """
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+    )
+    missing = serializers.IntegerField(
+        min_value=0,
+        max_value=MAX_MISSING,
+        default=0,
+    )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Список рецептов для пакетного добавления в избранное
+    или список покупок и удаления из них.
+    """
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=200,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class IngredientRecordSerializer(serializers.Serializer):
+    """
+    Ингредиент рецепта в файле выгрузки.
+    """
+
+    name = serializers.CharField(max_length=200)
+    measurement_unit = serializers.CharField(max_length=10)
+    amount = serializers.IntegerField(min_value=1, max_value=32767)
+
+
+class RecipeRecordSerializer(serializers.Serializer):
+    """
+    Рецепт в файле выгрузки: автор, теги и ингредиенты
+    указываются естественными ключами, картинка - именем
+    файла в хранилище.
+    """
+
+    name = serializers.CharField(max_length=200)
+    text = serializers.CharField()
+    cooking_time = serializers.IntegerField(min_value=1, max_value=32767)
+    author = serializers.EmailField()
+    image = serializers.CharField(max_length=100)
+    tags = serializers.ListField(
+        child=serializers.SlugField(max_length=10),
+        allow_empty=False,
+    )
+    ingredients = IngredientRecordSerializer(many=True, allow_empty=False)
+
+    def validate_ingredients(self, value):
+        keys = [(item['name'], item['measurement_unit']) for item in value]
+        if len(keys) != len(set(keys)):
+            raise ValidationError(
+                'Ингредиенты в рецепте должны быть уникальными!'
+            )
+        return value
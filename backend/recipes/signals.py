@@ -0,0 +1,149 @@
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from users.models import CustomUser
+
+from . import cache
+from .cookable import cookable_index
+from .ingredient_index import ingredient_index
+from .models import (Ingredient, IngredientsRecipe, Recipe,
+                     ShoppingCartIngredient, Tag)
+from .search import update_search_documents
+
+# Поля пользователя, которые входят в представление рецепта.
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """
+    Перестроение индекса ингредиентов после изменений.
+    """
+    ingredient_index.invalidate()
+
+
+@receiver(pre_save, sender=Recipe)
+def bump_recipe_cache_version(sender, instance, **kwargs):
+    """
+    Смена версии кэша рецепта тем же UPDATE, что и изменение:
+    версия, прочитанная в память до сохранения, не записывается
+    обратно поверх параллельного изменения.
+    """
+    if not instance._state.adding:
+        instance.cache_version = F('cache_version') + 1
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(sender, instance, created, update_fields, **kwargs):
+    """
+    Сброс кэша рецепта, если версия не вошла в сохраненные поля.
+    """
+    if not created and update_fields and (
+        'cache_version' not in update_fields
+    ):
+        cache.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_cookable_index(sender, instance, **kwargs):
+    """
+    Удаление рецепта из индекса ингредиентов.
+    """
+    cookable_index.mark_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Ingredient)
+def rebuild_cookable_index(sender, **kwargs):
+    """
+    Перестроение индекса после удаления ингредиента
+    вместе с его строками в рецептах.
+    """
+    cookable_index.invalidate()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    """
+    Вычитание ингредиентов удаляемого рецепта из списков покупок.
+    """
+    deltas = {
+        pk: -amount
+        for pk, amount in ShoppingCartIngredient.objects.recipe_amounts(
+            [instance.pk]
+        ).items()
+    }
+    ShoppingCartIngredient.objects.apply_deltas(
+        instance.shopping_cart.values_list('user_id', flat=True), deltas
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def mark_similar_stale(sender, instance, **kwargs):
+    """
+    Пересчет списков похожих рецептов, в которых есть удаляемый.
+    """
+    Recipe.objects.filter(
+        similar_recipes__similar=instance
+    ).update(similar_stale=True)
+
+
+@receiver((post_save, post_delete), sender=IngredientsRecipe)
+def invalidate_recipe_ingredients(sender, instance, origin=None, **kwargs):
+    """
+    Сброс кэша рецепта после изменения его ингредиентов,
+    кроме удаления вместе с рецептом.
+    """
+    if not isinstance(origin, Recipe):
+        cache.invalidate([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """
+    Сброс кэша рецептов после изменения их тегов.
+    """
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        cache.invalidate([instance.pk])
+    elif pk_set:
+        cache.invalidate(pk_set)
+    else:
+        cache.invalidate(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def invalidate_related_recipes(sender, instance, **kwargs):
+    """
+    Сброс кэша рецептов, в которых используется тег или ингредиент.
+    """
+    cache.invalidate(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_author_recipes(sender, instance, created, update_fields,
+                              **kwargs):
+    """
+    Сброс кэша рецептов автора после изменения его данных.
+    """
+    if created or (update_fields
+                   and not AUTHOR_FIELDS.intersection(update_fields)):
+        return
+    cache.invalidate(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search(sender, instance, created, **kwargs):
+    """
+    Обновление поисковых документов рецептов после
+    переименования ингредиента.
+    """
+    if not created:
+        update_search_documents(
+            instance.recipes.values_list('id', flat=True)
+        )
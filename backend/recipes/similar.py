@@ -0,0 +1,272 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from .models import IngredientsRecipe, Recipe, SimilarRecipe
+
+# Ингредиент частый, если он есть больше чем в FREQUENT_SHARE
+# рецептов и больше чем в FREQUENT_MIN рецептах.
+FREQUENT_SHARE = 0.02
+FREQUENT_MIN = 100
+# Сколько рецептов обрабатывается за одно умножение матриц.
+CHUNK_SIZE = 2048
+BATCH_SIZE = 5000
+# Число установленных битов в каждом байте.
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)],
+                    dtype=np.int32)
+
+
+def popcount(masks):
+    """
+    Число установленных битов в каждой строке массива масок uint64.
+    """
+    if not len(masks):
+        return np.zeros(0, dtype=np.int32)
+    return POPCOUNT[masks.view(np.uint8)].reshape(len(masks), -1).sum(1)
+
+
+class SimilarityMatrix:
+    """
+    Рецепты как множества ингредиентов и тегов. Кандидаты в похожие -
+    рецепты с общим редким ингредиентом: их дает произведение
+    разреженных матриц рецепт x ингредиент. Теги и частые ингредиенты
+    (соль, вода) хранятся битовыми масками и добавляются к пересечению
+    только для кандидатов, иначе произведение стало бы почти плотным.
+    """
+
+    def __init__(self, recipe_ids, ingredient_rows, tag_rows):
+        self.recipe_ids = np.unique(np.asarray(recipe_ids, dtype=np.int64))
+        ingredients = self.matrix(ingredient_rows)
+        tags = self.matrix(tag_rows)
+        self.sizes = ingredients.getnnz(axis=1) + tags.getnnz(axis=1)
+        recipes_count = ingredients.getnnz(axis=0)
+        frequent = recipes_count > max(
+            FREQUENT_SHARE * len(self.recipe_ids), FREQUENT_MIN
+        )
+        self.rare = ingredients[:, ~frequent].tocsr()
+        self.rare_t = self.rare.T.tocsr()
+        bits = sparse.hstack(
+            [ingredients[:, frequent], tags], format='coo'
+        )
+        words = max(1, (bits.shape[1] + 63) // 64)
+        self.masks = np.zeros((len(self.recipe_ids), words), dtype=np.uint64)
+        np.bitwise_or.at(
+            self.masks,
+            (bits.row, bits.col // 64),
+            np.left_shift(np.uint64(1), (bits.col % 64).astype(np.uint64)),
+        )
+
+    @classmethod
+    def load(cls):
+        return cls(
+            Recipe.objects.values_list('id', flat=True).order_by(),
+            IngredientsRecipe.objects.values_list(
+                'recipe_id', 'ingredient_id'
+            ).order_by(),
+            Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id'
+            ).order_by(),
+        )
+
+    def matrix(self, rows):
+        """
+        Бинарная матрица рецепт x признак по парам
+        (id рецепта, id признака).
+        """
+        pairs = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+        indices = self.rows(pairs[:, 0], keep_missing=True)
+        known = indices >= 0
+        _, columns = np.unique(pairs[known, 1], return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(known.sum(), dtype=np.int32),
+             (indices[known], columns)),
+            shape=(len(self.recipe_ids), columns.max(initial=-1) + 1),
+        )
+        matrix.data[:] = 1
+        return matrix
+
+    def rows(self, recipe_ids, keep_missing=False):
+        """
+        Номера строк рецептов; рецепты, которых нет в матрице,
+        пропускаются или получают -1.
+        """
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        rows = np.searchsorted(self.recipe_ids, recipe_ids)
+        rows[rows == len(self.recipe_ids)] = 0
+        found = self.recipe_ids[rows] == recipe_ids
+        if keep_missing:
+            return np.where(found, rows, -1)
+        return rows[found]
+
+    def candidates(self, rows, chunk_size=CHUNK_SIZE):
+        """
+        Для каждой строки rows - номера строк кандидатов
+        и их сходство по мере Жаккара.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            product = (self.rare[chunk] @ self.rare_t).tocsr()
+            own = np.repeat(chunk, np.diff(product.indptr))
+            columns = product.indices
+            common = product.data + popcount(
+                self.masks[own] & self.masks[columns]
+            )
+            scores = common / (
+                self.sizes[own] + self.sizes[columns] - common
+            )
+            for index, row in enumerate(chunk):
+                row_slice = slice(product.indptr[index],
+                                  product.indptr[index + 1])
+                other = columns[row_slice] != row
+                yield (row, columns[row_slice][other],
+                       scores[row_slice][other])
+
+    def neighbors(self, rows, k, chunk_size=CHUNK_SIZE):
+        """
+        Для каждой строки rows - id рецепта и k самых похожих
+        рецептов (id, сходство); при равном сходстве выше новые.
+        """
+        for row, columns, scores in self.candidates(rows, chunk_size):
+            if len(scores) > k:
+                # Все кандидаты не хуже k-го, чтобы при равенстве
+                # выбор не зависел от порядка.
+                threshold = np.partition(scores, len(scores) - k)[-k]
+                top = scores >= threshold
+                columns, scores = columns[top], scores[top]
+            similar_ids = self.recipe_ids[columns]
+            order = np.lexsort((-similar_ids, -scores))[:k]
+            yield int(self.recipe_ids[row]), [
+                (int(similar_id), float(score))
+                for similar_id, score in zip(similar_ids[order],
+                                             scores[order])
+            ]
+
+
+def save_neighbors(neighbors):
+    """
+    Запись списков похожих рецептов пачками; возвращает число списков.
+    """
+    count = 0
+    batch = []
+    for recipe_id, similar in neighbors:
+        count += 1
+        batch.extend(
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for similar_id, score in similar
+        )
+        if len(batch) >= BATCH_SIZE:
+            SimilarRecipe.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SimilarRecipe.objects.bulk_create(batch, ignore_conflicts=True)
+    return count
+
+
+def rebuild(k=None, chunk_size=CHUNK_SIZE):
+    """
+    Построение списков похожих рецептов для всех рецептов.
+    Возвращает число рецептов.
+    """
+    k = k or settings.SIMILAR_RECIPES_COUNT
+    Recipe.objects.filter(similar_stale=True).update(similar_stale=False)
+    matrix = SimilarityMatrix.load()
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        return save_neighbors(matrix.neighbors(
+            np.arange(len(matrix.recipe_ids)), k, chunk_size
+        ))
+
+
+def check(k=None):
+    """
+    Сверка сохраненных списков похожих рецептов с расчетом
+    по текущим данным. Возвращает id рецептов с расхождениями.
+    """
+    k = k or settings.SIMILAR_RECIPES_COUNT
+    matrix = SimilarityMatrix.load()
+    stored = {}
+    for recipe_id, similar_id, score in SimilarRecipe.objects.order_by(
+        '-score', '-similar_id'
+    ).values_list('recipe_id', 'similar_id', 'score'):
+        stored.setdefault(recipe_id, []).append((similar_id, score))
+    return [
+        recipe_id
+        for recipe_id, similar in matrix.neighbors(
+            np.arange(len(matrix.recipe_ids)), k
+        )
+        if [similar_id for similar_id, _ in stored.get(recipe_id, [])]
+        != [similar_id for similar_id, _ in similar]
+    ]
+
+
+def affected_recipes(matrix, stale, k):
+    """
+    Рецепты, списки которых нужно пересчитать после изменения stale:
+    сами измененные, рецепты, в списках которых они есть, и рецепты,
+    в списки которых они теперь проходят по сходству.
+    """
+    affected = set(stale)
+    affected.update(SimilarRecipe.objects.filter(
+        similar_id__in=stale
+    ).values_list('recipe_id', flat=True))
+    # Лучший из измененных рецептов для каждого кандидата
+    # в порядке списка: (сходство, id).
+    best = {}
+    for row, columns, scores in matrix.candidates(matrix.rows(stale)):
+        stale_id = int(matrix.recipe_ids[row])
+        for recipe_id, score in zip(matrix.recipe_ids[columns].tolist(),
+                                    scores.tolist()):
+            if recipe_id not in affected and (
+                best.get(recipe_id, (0, 0)) < (score, stale_id)
+            ):
+                best[recipe_id] = score, stale_id
+    candidates = sorted(best)
+    counts = dict.fromkeys(candidates, 0)
+    worst = {}
+    for start in range(0, len(candidates), BATCH_SIZE):
+        for recipe_id, similar_id, score in SimilarRecipe.objects.filter(
+            recipe_id__in=candidates[start:start + BATCH_SIZE]
+        ).values_list('recipe_id', 'similar_id', 'score'):
+            counts[recipe_id] += 1
+            worst[recipe_id] = min(
+                worst.get(recipe_id, (score, similar_id)),
+                (score, similar_id),
+            )
+    affected.update(
+        recipe_id for recipe_id in candidates
+        if counts[recipe_id] < k or best[recipe_id] > worst[recipe_id]
+    )
+    return affected
+
+
+def refresh_stale(k=None):
+    """
+    Пересчет списков похожих рецептов после изменения рецептов,
+    отмеченных similar_stale. Матрица загружается один раз на все
+    изменения. Возвращает число пересчитанных списков.
+    """
+    k = k or settings.SIMILAR_RECIPES_COUNT
+    stale = list(Recipe.objects.filter(
+        similar_stale=True
+    ).values_list('id', flat=True))
+    if not stale:
+        return 0
+    # Отметка снимается до чтения: изменения во время пересчета
+    # отметят рецепт снова.
+    Recipe.objects.filter(pk__in=stale).update(similar_stale=False)
+    try:
+        matrix = SimilarityMatrix.load()
+        affected = sorted(affected_recipes(matrix, stale, k))
+        with transaction.atomic():
+            for start in range(0, len(affected), BATCH_SIZE):
+                SimilarRecipe.objects.filter(
+                    recipe_id__in=affected[start:start + BATCH_SIZE]
+                ).delete()
+            return save_neighbors(
+                matrix.neighbors(matrix.rows(affected), k)
+            )
+    except Exception:
+        Recipe.objects.filter(pk__in=stale).update(similar_stale=True)
+        raise
@@ -0,0 +1,236 @@
+"""
+Выгрузка и загрузка рецептов в формате NDJSON: один рецепт
+в строке, автор, теги и ингредиенты - естественными ключами.
+"""
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+from users.models import CustomUser
+
+from .cookable import cookable_index
+from .counters import change_counter
+from .ingredient_index import ingredient_index
+from .models import FeedEntry, Ingredient, IngredientsRecipe, Recipe, Tag
+from .search import update_search_documents
+from .serializers import RecipeRecordSerializer
+
+CONTENT_TYPE = 'application/x-ndjson'
+
+
+def export_records(queryset=None, chunk_size=2000):
+    """
+    Рецепты в виде словарей. iterator() на PostgreSQL читает
+    серверным курсором; теги и ингредиенты выбираются для каждой
+    пачки отдельными запросами, без создания объектов моделей.
+    """
+    queryset = Recipe.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('id').values_list(
+        'id', 'name', 'text', 'cooking_time', 'author__email', 'image'
+    ).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        recipe_ids = [row[0] for row in chunk]
+        tags = defaultdict(list)
+        for recipe_id, slug in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'tag__slug').order_by('id'):
+            tags[recipe_id].append(slug)
+        ingredients = defaultdict(list)
+        for recipe_id, name, unit, amount in IngredientsRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list(
+            'recipe_id', 'ingredient__name', 'ingredient__measurement_unit',
+            'amount',
+        ).order_by('id'):
+            ingredients[recipe_id].append({
+                'name': name, 'measurement_unit': unit, 'amount': amount,
+            })
+        for pk, name, text, cooking_time, author, image in chunk:
+            yield {
+                'name': name,
+                'text': text,
+                'cooking_time': cooking_time,
+                'author': author,
+                'image': image,
+                'tags': tags[pk],
+                'ingredients': ingredients[pk],
+            }
+
+
+def export_lines(queryset=None, chunk_size=2000):
+    for record in export_records(queryset, chunk_size):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class RecipeImporter:
+    """
+    Загрузка рецептов пачками: каждая пачка сохраняется
+    bulk_create в своей транзакции. Ошибки отдельных строк
+    передаются в on_error и не прерывают загрузку; если пачка
+    не сохранилась целиком, ее рецепты сохраняются по одному.
+    Рецепт с тем же автором и названием пропускается.
+    """
+
+    def __init__(self, batch_size=500, default_author=None, on_error=None):
+        self.batch_size = batch_size
+        self.default_author = default_author
+        self.on_error = on_error or (lambda line, errors: None)
+        self.created = self.skipped = self.failed = 0
+        self.new_ingredients = False
+        # Один экземпляр на все строки: поля сериализатора
+        # копируются при создании каждого экземпляра.
+        self.serializer = RecipeRecordSerializer()
+
+    def error(self, line, errors):
+        self.failed += 1
+        self.on_error(line, errors)
+
+    def parse(self, lines):
+        """
+        Проверенные записи с номерами строк.
+        """
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as error:
+                self.error(number, {'non_field_errors': [str(error)]})
+                continue
+            try:
+                yield number, self.serializer.run_validation(data)
+            except ValidationError as error:
+                self.error(number, error.detail)
+
+    def run(self, lines):
+        records = self.parse(lines)
+        while batch := list(islice(records, self.batch_size)):
+            self.import_batch(batch)
+        if self.new_ingredients:
+            # bulk_create не отправляет сигналы post_save.
+            ingredient_index.invalidate()
+        return {
+            'created': self.created,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+
+    def import_batch(self, batch):
+        authors = CustomUser.objects.in_bulk(
+            {data['author'] for _, data in batch}, field_name='email'
+        )
+        tags = Tag.objects.in_bulk(
+            {slug for _, data in batch for slug in data['tags']},
+            field_name='slug',
+        )
+        candidates = [*authors.values(), self.default_author]
+        existing = set(Recipe.objects.filter(
+            author__in=[author for author in candidates if author],
+            name__in={data['name'] for _, data in batch},
+        ).values_list('author_id', 'name'))
+        valid = []
+        for line, data in batch:
+            author = authors.get(data['author'], self.default_author)
+            if author is None:
+                self.error(line, {'author': [
+                    f'Пользователь не найден: {data["author"]}'
+                ]})
+                continue
+            missing = sorted(set(data['tags']) - tags.keys())
+            if missing:
+                self.error(line, {'tags': [
+                    f'Теги не найдены: {", ".join(missing)}'
+                ]})
+                continue
+            if (author.pk, data['name']) in existing:
+                self.skipped += 1
+                continue
+            existing.add((author.pk, data['name']))
+            valid.append((line, author, data))
+        if len(valid) > 1:
+            try:
+                self.save(valid, tags)
+                return
+            except DatabaseError:
+                pass
+        for item in valid:
+            try:
+                self.save([item], tags)
+            except DatabaseError as error:
+                self.error(item[0], {'non_field_errors': [str(error)]})
+
+    def resolve_ingredients(self, keys):
+        """
+        Идентификаторы ингредиентов по названию и единице
+        измерения; недостающие ингредиенты создаются.
+        """
+        found = {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('id', 'name', 'measurement_unit')
+            if (name, unit) in keys
+        }
+        missing = keys - found.keys()
+        if missing:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in missing],
+                ignore_conflicts=True,
+            )
+            self.new_ingredients = True
+            found.update(
+                ((name, unit), pk)
+                for pk, name, unit in Ingredient.objects.filter(
+                    name__in={name for name, _ in missing}
+                ).values_list('id', 'name', 'measurement_unit')
+                if (name, unit) in missing
+            )
+        return found
+
+    @transaction.atomic
+    def save(self, items, tags):
+        ingredients = self.resolve_ingredients({
+            (item['name'], item['measurement_unit'])
+            for _, _, data in items for item in data['ingredients']
+        })
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author=author,
+                name=data['name'],
+                text=data['text'],
+                cooking_time=data['cooking_time'],
+                image=data['image'],
+            )
+            for _, author, data in items
+        ])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tags[slug].pk)
+            for recipe, (_, _, data) in zip(recipes, items)
+            for slug in set(data['tags'])
+        ])
+        IngredientsRecipe.objects.bulk_create([
+            IngredientsRecipe(
+                recipe_id=recipe.pk,
+                ingredient_id=ingredients[
+                    (item['name'], item['measurement_unit'])
+                ],
+                amount=item['amount'],
+            )
+            for recipe, (_, _, data) in zip(recipes, items)
+            for item in data['ingredients']
+        ])
+        for author_id, count in Counter(
+            author.pk for _, author, _ in items
+        ).items():
+            change_counter(CustomUser.objects.filter(pk=author_id),
+                           'recipes_count', count)
+        recipe_ids = [recipe.pk for recipe in recipes]
+        FeedEntry.objects.fan_out(recipe_ids)
+        update_search_documents(recipe_ids)
+        cookable_index.mark_changed(recipe_ids)
+        self.created += len(recipes)
@@ -1,37 +1,190 @@
-from django.http import HttpResponse
-from django.db.models import Sum
+import csv
+import io
+import itertools
+import os
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from foodgram_backend.async_views import streaming_content
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST
 
-from .models import IngredientsRecipe
+from .models import ShoppingCartIngredient
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """
+    Базовый формат выгрузки списка покупок.
+    Выбирается согласованием контента DRF по ?format= или Accept.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''
+
+    def header(self, user):
+        return f'Список покупок для: {user.get_full_name()}'
+
+    @abstractmethod
+    def stream(self, user, ingredients):
+        """
+        Генератор частей файла для StreamingHttpResponse.
+        """
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, ingredients):
+        yield f'{self.header(user)}\n\n'
+        separator = ''
+        for ingredient in ingredients:
+            yield (
+                f'{separator}- {ingredient["ingredient__name"]} '
+                f'({ingredient["ingredient__measurement_unit"]})'
+                f' - {ingredient["amount"]}'
+            )
+            separator = '\n'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    class Echo:
+        def write(self, value):
+            return value
+
+    def stream(self, user, ingredients):
+        writer = csv.writer(self.Echo())
+        # BOM нужен Excel для определения кодировки.
+        yield '\ufeff' + writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        )
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['ingredient__measurement_unit'],
+                ingredient['amount'],
+            ))
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """
+    PDF не пишется потоком: reportlab собирает документ целиком
+    в памяти, и только готовый файл отдается частями.
+    """
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_size = 12
+    line_height = 18
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def get_font(self):
+        """
+        Шрифт с кириллицей из настроек или встроенный Helvetica.
+        """
+        path = settings.SHOPPING_LIST_PDF_FONT
+        if not path or not os.path.exists(path):
+            return 'Helvetica'
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(name, path))
+        return name
+
+    def stream(self, user, ingredients):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        lines = itertools.chain(
+            (self.header(user), ''),
+            (
+                f'- {ingredient["ingredient__name"]} '
+                f'({ingredient["ingredient__measurement_unit"]})'
+                f' - {ingredient["amount"]}'
+                for ingredient in ingredients
+            ),
+        )
+        y = height - self.margin
+        pdf.setFont(font, self.font_size)
+        for line in lines:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                y = height - self.margin
+            pdf.drawString(self.margin, y, line)
+            y -= self.line_height
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """
+    Формат по ?format= или Accept; если Accept не подходит
+    ни под один формат (например, application/json), список
+    отдается текстом, а не ошибкой 406.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
 
 
 def get_shopping_list(request):
     """
     Формирование списка покупок для выгрузки.
+    Суммы берутся из сводной таблицы и читаются из базы
+    потоком по мере отправки файла.
     """
     user = request.user
-    if not user.shopping_cart.exists():
-        return Response(status=HTTP_400_BAD_REQUEST)
-
-    ingredients = IngredientsRecipe.objects.filter(
-        recipe__shopping_cart__user=request.user
+    ingredients = ShoppingCartIngredient.objects.filter(
+        user=user
     ).values(
         'ingredient__name',
-        'ingredient__measurement_unit'
-    ).annotate(amount=Sum('amount'))
+        'ingredient__measurement_unit',
+        'amount'
+    ).order_by(
+        'ingredient__name'
+    ).iterator()
+
+    first = next(ingredients, None)
+    if first is None:
+        return Response(status=HTTP_400_BAD_REQUEST)
 
-    shopping_list = (
-        f'Список покупок для: {user.get_full_name()}\n\n'
+    renderer = request.accepted_renderer
+    response = StreamingHttpResponse(
+        streaming_content(request, renderer.stream(
+            user, itertools.chain((first,), ingredients)
+        )),
+        content_type=(
+            f'{renderer.media_type}; charset={renderer.charset}'
+            if renderer.charset else renderer.media_type
+        ),
     )
-    shopping_list += '\n'.join([
-        f'- {ingredient["ingredient__name"]} '
-        f'({ingredient["ingredient__measurement_unit"]})'
-        f' - {ingredient["amount"]}'
-        for ingredient in ingredients
-    ])
-
-    filename = f'{user.username}_shopping_list.txt'
-    response = HttpResponse(shopping_list, content_type='text/plain')
+    filename = f'{user.username}_shopping_list.{renderer.format}'
     response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
@@ -1,21 +1,54 @@
-from django.shortcuts import get_object_or_404
+import time
+
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from foodgram_backend.async_views import AsyncReadMixin, streaming_content
+from foodgram_backend.db import delete_returning, insert_link, insert_links
+from foodgram_backend.db_router import ReplicaReadMixin
+from foodgram_backend.middleware import ServerTimingMixin
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from users.models import CustomUser
 
+from . import rankings
+from .cache import arender_recipes, render_recipes
+from .cookable import cookable_index
+from .counters import change_counter
 from .filters import IngredientFilter, RecipeFilter
-from .models import FavoriteRecipe, Ingredient, Recipe, ShoppingCart, Tag
-from .pagination import CustomPageNumberPagination
+from .ingredient_index import ingredient_index
+from .models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                     ShoppingCart, ShoppingCartIngredient, SimilarRecipe, Tag)
+from .pagination import (CustomPageNumberPagination, FeedPagination,
+                         KeysetPagination)
+from .parsers import NDJSONParser
 from .permissions import AuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeCreateUpdateSerializer,
+from .serializers import (CookableQuerySerializer, IngredientSerializer,
+                          RecipeCreateUpdateSerializer, RecipeIdsSerializer,
                           RecipeSerializer, ShortRecipeSerializer,
                           TagSerializer)
-from .utils import get_shopping_list
+from .transfer import CONTENT_TYPE, RecipeImporter, export_lines
+from .utils import (SHOPPING_LIST_RENDERERS, ShoppingListNegotiation,
+                    get_shopping_list)
+
+# Сколько ошибок отдельных строк возвращать в ответе на загрузку.
+IMPORT_ERRORS_LIMIT = 100
+
+
+def parse_pk(value):
+    """
+    Идентификатор из URL: не число - 404.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Http404
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AsyncReadMixin, ReplicaReadMixin, ServerTimingMixin,
+                    viewsets.ModelViewSet):
     """
     Вьюсет для модели рецепта.
     """
@@ -26,6 +59,64 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     permission_classes = (AuthorOrReadOnly,)
     pagination_class = CustomPageNumberPagination
+    async_actions = ('list', 'retrieve')
+    counter_fields = {
+        FavoriteRecipe: 'favorites_count',
+        ShoppingCart: 'shopping_cart_count',
+    }
+
+    def get_queryset(self):
+        """
+        Рецепты с флагами текущего пользователя. Для чтения
+        достаточно ключевых полей: представления берутся из кэша.
+        """
+        queryset = Recipe.objects.with_user_flags(self.request.user)
+        if self.action in ('list', 'retrieve'):
+            return queryset.only('id', 'author', 'pub_date',
+                                 'favorites_count', 'cache_version',
+                                 'popular_rank', 'trending_rank')
+        return queryset.with_related()
+
+    @property
+    def cursor_ordering(self):
+        """
+        Порядок курсорной паджинации по параметру ordering.
+        """
+        return rankings.ORDERINGS.get(
+            self.request.query_params.get('ordering'),
+            KeysetPagination.ordering,
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_recipes(page, request))
+        return Response(render_recipes(queryset, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(render_recipes([self.get_object()], request)[0])
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                await arender_recipes(page, request)
+            )
+        return Response(await arender_recipes(
+            [recipe async for recipe in queryset], request
+        ))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        recipe = await self.aget_object()
+        return Response((await arender_recipes([recipe], request))[0])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        change_counter(CustomUser.objects.filter(pk=instance.author_id),
+                       'recipes_count', -1)
+        instance.delete()
 
     def get_serializer_class(self):
         """
@@ -61,37 +152,278 @@ class RecipeViewSet(viewsets.ModelViewSet):
         else:
             return self.delete_from(ShoppingCart, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='favorite/batch',
+        url_name='favorite-batch',
+    )
+    def favorite_batch(self, request):
+        """
+        Добавление и удаление списка рецептов из избранного.
+        """
+        return self.change_batch(FavoriteRecipe, request)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='shopping_cart/batch',
+        url_name='shopping-cart-batch',
+    )
+    def shopping_cart_batch(self, request):
+        """
+        Добавление и удаление списка рецептов из списка покупок.
+        """
+        return self.change_batch(ShoppingCart, request)
+
+    def change_batch(self, model, request):
+        """
+        Результат по каждому рецепту: added, exists и not_found
+        при добавлении, removed и not_in_list при удалении.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            results = self.add_many(model, request.user, recipe_ids)
+        else:
+            results = self.delete_many(model, request.user, recipe_ids)
+        return Response({'results': [
+            {'id': pk, 'status': results[pk]} for pk in recipe_ids
+        ]})
+
+    @transaction.atomic
+    def add_many(self, model, user, recipe_ids):
+        """
+        Вставка одним INSERT ... RETURNING: счетчики и список
+        покупок меняются только для строк, вставленных этим
+        запросом, даже при параллельных добавлениях.
+        """
+        now = time.time()
+        new = insert_links(
+            model, {'user': user.pk, 'added_at': now}, 'recipe', recipe_ids
+        )
+        if new:
+            change_counter(Recipe.objects.filter(pk__in=new),
+                           self.counter_fields[model], 1,
+                           **rankings.added(model, now))
+            if model is ShoppingCart:
+                ShoppingCartIngredient.objects.add_recipes(user, new)
+        new = set(new)
+        found = set(Recipe.objects.filter(
+            pk__in=set(recipe_ids) - new
+        ).values_list('pk', flat=True)) | new
+        return {
+            pk: 'not_found' if pk not in found
+            else 'added' if pk in new else 'exists'
+            for pk in recipe_ids
+        }
+
+    @transaction.atomic
+    def delete_many(self, model, user, recipe_ids):
+        """
+        Удаление одним DELETE ... RETURNING, как в delete_from.
+        """
+        rows = delete_returning(
+            model.objects.filter(user=user, recipe_id__in=recipe_ids),
+            ('recipe_id', 'added_at'),
+        )
+        removed = {recipe_id for recipe_id, _ in rows}
+        if rows:
+            change_counter(Recipe.objects.filter(pk__in=removed),
+                           self.counter_fields[model], -1,
+                           **rankings.removed(model, rows, time.time()))
+            if model is ShoppingCart:
+                ShoppingCartIngredient.objects.remove_recipes(user, removed)
+        return {
+            pk: 'removed' if pk in removed else 'not_in_list'
+            for pk in recipe_ids
+        }
+
     def add_to(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        """
+        Добавление одним запросом INSERT ... ON CONFLICT DO NOTHING:
+        повторный запрос получает 400, а не ошибку целостности.
+        """
+        pk = parse_pk(pk)
+        now = time.time()
+        with transaction.atomic():
+            created = insert_link(
+                model, {'user': user.pk, 'added_at': now}, 'recipe', pk
+            )
+            if created:
+                change_counter(Recipe.objects.filter(pk=pk),
+                               self.counter_fields[model], 1,
+                               **rankings.added(model, now))
+                if model is ShoppingCart:
+                    ShoppingCartIngredient.objects.add_recipes(user, [pk])
+        if not created:
+            if not Recipe.objects.filter(pk=pk).exists():
+                raise Http404
             return Response({'errors': 'Рецепт уже добавлен!'},
                             status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
+        recipe = Recipe.objects.only(
+            'name', 'image', 'cooking_time', 'image_variants'
+        ).get(pk=pk)
         serializer = ShortRecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_from(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Рецепт уже удален!'},
-                        status=status.HTTP_400_BAD_REQUEST)
+        pk = parse_pk(pk)
+        with transaction.atomic():
+            rows = delete_returning(
+                model.objects.filter(user=user, recipe_id=pk),
+                ('recipe_id', 'added_at'),
+            )
+            deleted = len(rows)
+            if deleted:
+                change_counter(Recipe.objects.filter(pk=pk),
+                               self.counter_fields[model], -deleted,
+                               **rankings.removed(model, rows, time.time()))
+                if model is ShoppingCart:
+                    ShoppingCartIngredient.objects.remove_recipes(user, [pk])
+        if not deleted:
+            return Response({'errors': 'Рецепт уже удален!'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        """
+        page = self.paginate_queryset(
+            FeedEntry.objects.timeline(request.user)
+        )
+        recipes = Recipe.objects.with_user_flags(request.user).only(
+            'id', 'author', 'pub_date', 'favorites_count', 'cache_version'
+        ).in_bulk([recipe_id for recipe_id, _ in page])
+        return self.get_paginated_response(render_recipes(
+            [recipes[pk] for pk, _ in page if pk in recipes], request
+        ))
+
+    @action(
+        detail=True,
+        methods=('get',),
+        pagination_class=None,
+    )
+    def similar(self, request, pk=None):
+        """
+        Рецепты, похожие на рецепт по ингредиентам и тегам,
+        от самого похожего.
+        """
+        pk = parse_pk(pk)
+        similar_ids = list(SimilarRecipe.objects.filter(
+            recipe_id=pk
+        ).order_by('-score', '-similar_id').values_list(
+            'similar_id', flat=True
+        ))
+        if not similar_ids and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        recipes = Recipe.objects.with_user_flags(request.user).only(
+            'id', 'author', 'pub_date', 'favorites_count', 'cache_version'
+        ).in_bulk(similar_ids)
+        return Response(render_recipes(
+            [recipes[pk] for pk in similar_ids if pk in recipes], request
+        ))
+
+    @action(
+        detail=False,
+        methods=('get',),
+    )
+    def cookable(self, request):
+        """
+        Рецепты из имеющихся ингредиентов (?ingredients=), в которых
+        не хватает не более ?missing= ингредиентов. Сначала идут
+        рецепты с меньшим числом недостающих ингредиентов.
+        """
+        params = CookableQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        result = cookable_index.search(
+            params.validated_data['ingredients'],
+            params.validated_data['missing'],
+        )
+        page = self.paginate_queryset(result)
+        if page is None:
+            page = result[:]
+        recipes = Recipe.objects.with_user_flags(request.user).only(
+            'id', 'author', 'pub_date', 'favorites_count', 'cache_version'
+        ).in_bulk([recipe_id for recipe_id, _ in page])
+        missing = dict(page)
+        data = render_recipes(
+            [recipes[pk] for pk, _ in page if pk in recipes], request
+        )
+        for item in data:
+            item['missing_count'] = missing[item['id']]
+        if self.paginator is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
     @action(
         detail=False,
         methods=('get',),
         url_path='download_shopping_cart',
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=ShoppingListNegotiation,
     )
     def download_shopping_cart(self, request):
         """
-        Загрузка списка покупок.
+        Загрузка списка покупок в формате txt, csv или pdf (?format=).
         """
         return get_shopping_list(request)
 
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        """
+        Выгрузка всех рецептов в формате NDJSON.
+        """
+        response = StreamingHttpResponse(
+            streaming_content(request, export_lines()),
+            content_type=CONTENT_TYPE,
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="recipes.ndjson"'
+        )
+        return response
+
+    @action(
+        detail=False,
+        methods=('post',),
+        url_path='import',
+        url_name='import',
+        permission_classes=(IsAdminUser,),
+        parser_classes=(NDJSONParser,),
+    )
+    def import_recipes(self, request):
+        """
+        Загрузка рецептов из NDJSON. Авторы, которых нет в базе,
+        заменяются текущим пользователем.
+        """
+        errors = []
+
+        def on_error(line, line_errors):
+            if len(errors) < IMPORT_ERRORS_LIMIT:
+                errors.append({'line': line, 'errors': line_errors})
+
+        result = RecipeImporter(
+            default_author=request.user, on_error=on_error
+        ).run(request.data)
+        result['errors'] = errors
+        return Response(result, status=status.HTTP_200_OK)
 
-class IngredientsViewSet(viewsets.ModelViewSet):
+
+class IngredientsViewSet(AsyncReadMixin, ReplicaReadMixin, ServerTimingMixin,
+                         viewsets.ModelViewSet):
     """
     Вьюсет для модели ингредиента.
     """
@@ -101,9 +433,35 @@ class IngredientsViewSet(viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    async_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по началу названия отдается из индекса в памяти
+        без обращения к базе данных.
+        """
+        if (request.accepted_renderer.format != 'json'
+                or set(request.query_params) - {'name'}):
+            return super().list(request, *args, **kwargs)
+        return HttpResponse(
+            ingredient_index.render(request.query_params.get('name', '')),
+            content_type='application/json',
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        if (request.accepted_renderer.format != 'json'
+                or set(request.query_params) - {'name'}):
+            return await super().alist(request, *args, **kwargs)
+        return HttpResponse(
+            await ingredient_index.arender(
+                request.query_params.get('name', '')
+            ),
+            content_type='application/json',
+        )
 
 
-class TagsViewSet(viewsets.ModelViewSet):
+class TagsViewSet(AsyncReadMixin, ReplicaReadMixin, ServerTimingMixin,
+                  viewsets.ModelViewSet):
     """
     Вьюсет для модели тега.
     """
@@ -111,3 +469,4 @@ class TagsViewSet(viewsets.ModelViewSet):
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    async_actions = ('list', 'retrieve')
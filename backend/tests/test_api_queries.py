@@ -0,0 +1,44 @@
+import json
+import logging
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from recipes import images
+from recipes.benchmark import (BASELINE_PATH, BENCHMARK_SETTINGS, Context,
+                               api_route_names, default_scenarios,
+                               run_scenario, seed)
+
+REPEAT = 2
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class ApiQueriesTests(TransactionTestCase):
+    """
+    Сценарии замера API: у каждого маршрута есть сценарий,
+    ни один ответ не 5xx, SQL-запросов не больше эталона
+    из data/benchmark_baseline.json.
+    """
+
+    def test_every_route_has_scenario(self):
+        self.assertEqual(
+            api_route_names() - {s.url_name for s in default_scenarios()},
+            set(),
+        )
+
+    def test_queries_within_baseline(self):
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.addCleanup(images.wait)
+        cache.clear()
+        seed(users=30, recipes=100)
+        ctx = Context(REPEAT)
+        for scenario in default_scenarios():
+            result = run_scenario(scenario, ctx, REPEAT)
+            with self.subTest(scenario.name):
+                self.assertLess(max(result.statuses), 500)
+                self.assertIn(scenario.name, baseline)
+                self.assertLessEqual(
+                    result.queries, baseline[scenario.name]['queries']
+                )
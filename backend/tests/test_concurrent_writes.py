@@ -0,0 +1,139 @@
+import logging
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from recipes import rankings
+from recipes.benchmark import Context, seed
+from recipes.counters import reconcile
+from recipes.models import FeedEntry, ShoppingCartIngredient
+from rest_framework.test import APIClient
+
+THREADS = 8
+ROUNDS = 3
+
+
+def recipe_path(action):
+    return lambda ctx: f'/api/recipes/{ctx.free_recipes[0]}/{action}/'
+
+
+def subscribe_path(ctx):
+    return f'/api/users/{ctx.free_authors[0]}/subscribe/'
+
+
+# Операция, метод, путь, код успешного ответа и наибольшее
+# допустимое число SQL-запросов (с BEGIN и COMMIT на SQLite).
+OPERATIONS = (
+    ('favorite_add', 'post', recipe_path('favorite'), 201, 6),
+    ('favorite_delete', 'delete', recipe_path('favorite'), 204, 5),
+    ('shopping_cart_add', 'post', recipe_path('shopping_cart'), 201, 9),
+    ('shopping_cart_delete', 'delete', recipe_path('shopping_cart'), 204, 8),
+    ('subscribe', 'post', subscribe_path, 201, 10),
+    ('unsubscribe', 'delete', subscribe_path, 204, 7),
+)
+
+
+@override_settings(
+    DATABASE_REPLICAS=[],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ConcurrentWritesTests(TransactionTestCase):
+    """
+    Одновременные одинаковые запросы на запись от одного
+    пользователя: ровно один успешный ответ, остальные - 400,
+    ни одной ошибки сервера и счетчики без расхождений.
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Общая база в памяти блокирует таблицы без ожидания,
+            # параллельным потокам нужна база в файле (TEST NAME).
+            self.skipTest('нужна тестовая база, доступная из потоков')
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        cache.clear()
+        seed(users=30, recipes=100)
+        self.ctx = Context(1)
+
+    def fire(self, requests):
+        """
+        Запросы (метод, путь, тело), отправленные одновременно
+        из отдельных потоков; результат - ответы и число
+        SQL-запросов каждого.
+        """
+        barrier = threading.Barrier(len(requests))
+        results = []
+
+        def worker(method, path, data):
+            client = APIClient(raise_request_exception=False)
+            client.credentials(
+                HTTP_AUTHORIZATION=f'Token {self.ctx.tokens["main"]}'
+            )
+            try:
+                barrier.wait()
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(client, method)(
+                        path, data, format='json'
+                    )
+                results.append((response, len(queries)))
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=worker, args=request)
+            for request in requests
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def assertConsistent(self):
+        for label, count in reconcile(dry_run=True).items():
+            self.assertEqual(count, 0, label)
+        self.assertEqual(
+            ShoppingCartIngredient.objects.rebuild(dry_run=True), (0, 0, 0)
+        )
+        self.assertEqual(rankings.rebuild(dry_run=True), 0)
+        self.assertEqual(FeedEntry.objects.rebuild(dry_run=True), (0, 0))
+
+    def test_same_request_from_threads(self):
+        for _ in range(ROUNDS):
+            for name, method, path, success, limit in OPERATIONS:
+                with self.subTest(name):
+                    results = self.fire(
+                        [(method, path(self.ctx), None)] * THREADS
+                    )
+                    statuses = Counter(
+                        response.status_code for response, _ in results
+                    )
+                    self.assertEqual(statuses, {success: 1,
+                                                400: THREADS - 1})
+                    self.assertLessEqual(
+                        max(count for _, count in results), limit
+                    )
+        self.assertConsistent()
+
+    def test_batch_and_single_adds(self):
+        recipe_id = self.ctx.free_recipes[0]
+        batch = {'recipes': [recipe_id, *self.ctx.batch_recipes[:3]]}
+        for method in ('post', 'delete'):
+            results = self.fire([
+                (method, f'/api/recipes/{recipe_id}/shopping_cart/', None),
+                (method, '/api/recipes/shopping_cart/batch/', batch),
+            ] * (THREADS // 2))
+            changed = 0
+            for response, _ in results:
+                if response.status_code == 200:
+                    changed += response.json()['results'][0]['status'] in (
+                        'added', 'removed'
+                    )
+                else:
+                    self.assertIn(response.status_code, (201, 204, 400))
+                    changed += response.status_code != 400
+            self.assertEqual(changed, 1)
+        self.assertConsistent()
@@ -0,0 +1,112 @@
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from recipes.benchmark import Context, seed
+from rest_framework.test import APIClient
+
+REPLICA = 'replica'
+PIN_SECONDS = 1
+
+
+@override_settings(
+    DATABASE_REPLICAS=[],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Маршрутизация запросов на двух тестовых базах: реплику
+    изображает копия основной базы без репликации, поэтому
+    по ответам видно, из какой базы прочитаны данные.
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Базу в памяти нельзя скопировать, нужен файл (TEST NAME).
+            self.skipTest('нужна тестовая база, которую можно скопировать')
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        cache.clear()
+        seed(users=30, recipes=100)
+        self.ctx = Context(1)
+        connection.close()
+        connection.creation.clone_test_db(
+            suffix=REPLICA, verbosity=0, autoclobber=True
+        )
+        connections.settings[REPLICA] = (
+            connection.creation.get_test_db_clone_settings(REPLICA)
+        )
+        self.addCleanup(self.drop_replica)
+        routing = override_settings(DATABASE_REPLICAS=[REPLICA],
+                                    REPLICA_PIN_SECONDS=PIN_SECONDS)
+        routing.enable()
+        self.addCleanup(routing.disable)
+        self.anonymous = self.client_for()
+        self.main = self.client_for(self.ctx.tokens['main'])
+        self.spare = self.client_for(self.ctx.tokens['spare'])
+
+    def drop_replica(self):
+        connections[REPLICA].close()
+        connection.creation.destroy_test_db(verbosity=0, suffix=REPLICA)
+        del connections.settings[REPLICA]
+
+    def client_for(self, token=None):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return client
+
+    def request(self, client, method, path, expected, token=False):
+        """
+        Ответ на запрос, который должен читать с expected:
+        'primary' или 'replica'. Токен всегда проверяется
+        по основной базе.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = getattr(client, method)(path)
+        name = f'{method.upper()} {path}'
+        self.assertLess(response.status_code, 400, name)
+        if expected == 'primary':
+            self.assertEqual(len(replica), 0, name)
+        else:
+            self.assertGreater(len(replica), 0, name)
+            self.assertLessEqual(len(primary), int(token), name)
+        return response
+
+    def test_safe_reads_go_to_replica(self):
+        reads = (
+            '/api/recipes/',
+            f'/api/recipes/{self.ctx.recipe.pk}/',
+            '/api/tags/',
+            f'/api/tags/{self.ctx.tag.pk}/',
+            f'/api/ingredients/{self.ctx.ingredients[0]}/',
+            '/api/users/',
+            f'/api/users/{self.ctx.other.pk}/',
+        )
+        # Кэш представлений и индексы в памяти заполняются
+        # с основной базы, дальше чтение идет с реплики.
+        for path in reads:
+            self.anonymous.get(path)
+        for path in reads:
+            self.request(self.anonymous, 'get', path, 'replica')
+        for path in ('/api/users/me/', '/api/users/subscriptions/'):
+            self.request(self.main, 'get', path, 'replica', token=True)
+
+    def test_own_writes_read_from_primary(self):
+        recipe_id = self.ctx.free_recipes[0]
+        self.request(self.main, 'post',
+                     f'/api/recipes/{recipe_id}/favorite/', 'primary')
+        path = f'/api/recipes/{recipe_id}/'
+        response = self.request(self.main, 'get', path, 'primary')
+        self.assertTrue(response.data['is_favorited'])
+        self.request(self.spare, 'get', path, 'replica', token=True)
+
+        time.sleep(PIN_SECONDS + 0.1)
+        response = self.request(self.main, 'get', path, 'replica',
+                                token=True)
+        # Копия не получает изменений: флаг с реплики - старый.
+        self.assertFalse(response.data['is_favorited'])
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+from django.test import TestCase
+from recipes.ingredient_index import VERSION_KEY, ingredient_index
+from recipes.models import Ingredient
+
+
+class IngredientIndexTests(TestCase):
+    """
+    Индекс ингредиентов видит изменения только после фиксации.
+    """
+
+    def test_version_changes_after_commit(self):
+        cache.clear()
+        self.assertEqual(ingredient_index.render('соль'), b'[]')
+        version = cache.get(VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Ingredient.objects.create(name='Соль', measurement_unit='г')
+            self.assertEqual(cache.get(VERSION_KEY), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(cache.get(VERSION_KEY), version)
+        self.assertIn('Соль'.encode(), ingredient_index.render('соль'))
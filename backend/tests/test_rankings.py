@@ -0,0 +1,94 @@
+import time
+from base64 import b64encode
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from recipes import rankings
+from recipes.benchmark import seed
+from recipes.models import Recipe
+from rest_framework.test import APIClient
+
+PAGE_SIZE = 4
+
+
+@override_settings(
+    DATABASE_REPLICAS=[],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class RankingPaginationTests(TestCase):
+    """
+    Курсорная паджинация по рангу популярности: каждый рецепт
+    попадает ровно на одну страницу, в том числе среди рецептов
+    с одинаковым рангом, а ранги не меняются со временем.
+    """
+
+    def setUp(self):
+        cache.clear()
+        seed(users=10, recipes=30, follows_per_user=5, cart_size=5)
+        self.client = APIClient()
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data[link]
+        return ids
+
+    def test_cursor_pages_cover_all_recipes(self):
+        for ordering, fields in rankings.ORDERINGS.items():
+            with self.subTest(ordering):
+                expected = list(Recipe.objects.order_by(*fields)
+                                .values_list('id', flat=True))
+                self.assertGreater(
+                    len(expected), len(set(Recipe.objects.values_list(
+                        fields[0].lstrip('-'), flat=True
+                    )))
+                )
+                forward = self.walk(
+                    f'/api/recipes/?ordering={ordering}'
+                    f'&limit={PAGE_SIZE}&cursor=', 'next'
+                )
+                self.assertEqual(forward, expected)
+
+    def test_previous_links_return_same_pages(self):
+        url = f'/api/recipes/?ordering=popular&limit={PAGE_SIZE}&cursor='
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append([recipe['id']
+                          for recipe in response.data['results']])
+            url = response.data['next']
+        previous = response.data['previous']
+        for page in reversed(pages[:-1]):
+            response = self.client.get(previous)
+            self.assertEqual(
+                [recipe['id'] for recipe in response.data['results']], page
+            )
+            previous = response.data['previous']
+        self.assertIsNone(previous)
+
+    def test_invalid_cursor(self):
+        for position in ('[1.0]', '[1.0, "вчера", 1]', '{}', 'x'):
+            with self.subTest(position):
+                cursor = b64encode(urlencode({'p': position}).encode())
+                response = self.client.get(
+                    '/api/recipes/?ordering=popular&cursor='
+                    + cursor.decode()
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_ranks_do_not_change_over_time(self):
+        ranks = list(Recipe.objects.values_list('popular_rank',
+                                                'trending_rank'))
+        later = time.time() + 5 * rankings.DAY
+        with mock.patch('recipes.rankings.time.time', return_value=later):
+            self.assertEqual(rankings.rebuild(dry_run=True), 0)
+        self.assertEqual(
+            list(Recipe.objects.values_list('popular_rank',
+                                            'trending_rank')),
+            ranks,
+        )
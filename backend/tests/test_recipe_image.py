@@ -0,0 +1,41 @@
+import os
+from unittest import mock
+
+from django.test import TestCase
+from recipes.benchmark import pixel_png
+from recipes.fields import RecipeImageField
+from recipes.models import Tag
+from recipes.serializers import RecipeCreateUpdateSerializer
+
+
+class RecipeImageTests(TestCase):
+    """
+    Временный файл картинки из base64 удаляется, если рецепт
+    не прошел проверку.
+    """
+
+    def test_decoded_file_removed_on_validation_error(self):
+        tag = Tag.objects.create(name='Завтрак', color='#FFFFFF',
+                                 slug='breakfast')
+        paths = []
+        decode = RecipeImageField.decode
+
+        def record(field, data):
+            file = decode(field, data)
+            paths.append(file.temporary_file_path())
+            return file
+
+        serializer = RecipeCreateUpdateSerializer(data={
+            'tags': [tag.pk],
+            'ingredients': [{'id': 0, 'amount': 1}],
+            'image': pixel_png(),
+            'name': 'Каша',
+            'text': 'Сварить.',
+            'cooking_time': 10,
+        })
+        with mock.patch.object(RecipeImageField, 'decode', record):
+            self.assertFalse(serializer.is_valid())
+        self.assertIn('ingredients', serializer.errors)
+        self.assertNotIn('image', serializer.errors)
+        self.assertEqual(len(paths), 1)
+        self.assertFalse(os.path.exists(paths[0]))
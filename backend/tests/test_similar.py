@@ -0,0 +1,42 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from recipes import similar
+
+
+class SimilarityMatrixTests(SimpleTestCase):
+    """
+    Граничные случаи матрицы похожих рецептов.
+    """
+
+    def neighbors(self, recipe_ids, ingredients, tags, recipe_id):
+        with mock.patch.object(similar, 'FREQUENT_MIN', 2):
+            matrix = similar.SimilarityMatrix(recipe_ids, ingredients, tags)
+        return [
+            similar_id
+            for _, neighbors in matrix.neighbors(matrix.rows([recipe_id]), 5)
+            for similar_id, _ in neighbors
+        ]
+
+    def test_popcount_empty(self):
+        result = similar.popcount(np.zeros((0, 1), dtype=np.uint64))
+        self.assertEqual(result.shape, (0,))
+
+    def test_no_rare_ingredients(self):
+        self.assertEqual(self.neighbors(
+            [1, 2, 3, 4],
+            [(1, 10), (2, 10), (3, 10), (4, 10), (2, 20), (3, 20)],
+            [], 1,
+        ), [])
+
+    def test_recipe_without_ingredients_and_tags(self):
+        self.assertEqual(self.neighbors([1, 2], [(2, 10)], [], 1), [])
+
+    def test_empty_matrix(self):
+        self.assertEqual(self.neighbors([1], [], [], 1), [])
+
+    def test_rare_ingredient_and_tag(self):
+        self.assertEqual(self.neighbors(
+            [1, 2, 3], [(1, 10), (2, 10), (3, 30)], [(1, 5), (2, 5)], 1,
+        ), [2])
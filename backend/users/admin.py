@@ -8,7 +8,8 @@ class UsersAdmin(admin.ModelAdmin):
     Настройка админ-зоны для модели пользователя.
     """
 
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = ('username', 'first_name', 'last_name', 'email',
+                    'recipes_count', 'followers_count')
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
     empty_value_display = "-пусто-"
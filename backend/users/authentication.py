@@ -0,0 +1,219 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from foodgram_backend.cache import is_shared_cache
+from rest_framework import authentication, exceptions
+
+TOKEN_KEY = 'auth:token:{}'
+# Отметка сброшенного токена в общем кэше: не дает параллельному
+# запросу вернуть в кэш данные, прочитанные до сброса.
+INVALIDATED = 'invalidated'
+INVALIDATED_TIMEOUT = 10
+# Поля пользователя, которые не попадают в кэш: хэш пароля
+# и счетчики, которые меняются UPDATE без сброса кэша.
+# save() у такого пользователя записывает только загруженные поля.
+DEFERRED_USER_FIELDS = (
+    'user__password',
+    'user__recipes_count',
+    'user__followers_count',
+    'user__following_count',
+)
+
+
+def cache_key(key):
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+class LocalTokenCache:
+    """
+    Ограниченный LRU-кэш токенов в памяти процесса с коротким
+    временем жизни записей: сброс в другом процессе доходит
+    до него не позже TOKEN_LOCAL_CACHE_TIMEOUT секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        expires_at = time.monotonic() + settings.TOKEN_LOCAL_CACHE_TIMEOUT
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_LOCAL_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+local_tokens = LocalTokenCache()
+
+
+def invalidate_tokens(keys):
+    """
+    Сброс токенов в кэше после фиксации транзакции, чтобы
+    параллельный запрос не вернул в кэш старые данные.
+    """
+    keys = [cache_key(key) for key in keys]
+    if not keys:
+        return
+
+    def drop():
+        if is_shared_cache():
+            cache.set_many(
+                dict.fromkeys(keys, INVALIDATED), INVALIDATED_TIMEOUT
+            )
+        local_tokens.delete_many(keys)
+
+    transaction.on_commit(drop)
+
+
+class AsyncTokenAuthentication(authentication.TokenAuthentication):
+    """
+    Аутентификация по токену с асинхронным вариантом
+    aauthenticate для асинхронных вьюх чтения.
+    """
+
+    def get_key(self, request):
+        """
+        Ключ токена из заголовка Authorization
+        или None, если заголовка с токеном нет.
+        """
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. No credentials provided.')
+            )
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain spaces.'
+            ))
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain invalid characters.'
+            ))
+
+    def authenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token.user, token
+
+
+class CachedTokenAuthentication(AsyncTokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе: токен с пользователем
+    хранится в LRU-кэше процесса и в общем кэше на TOKEN_CACHE_TIMEOUT
+    секунд. Записи сбрасываются при выходе, смене пароля
+    и любом сохранении пользователя (users.signals). Кэш в памяти
+    процесса (LocMemCache) не общий: сброс в нем не дошел бы
+    до других воркеров, поэтому с ним используется только LRU
+    с коротким временем жизни.
+    """
+
+    def get_queryset(self):
+        return self.get_model().objects.select_related('user').defer(
+            *DEFERRED_USER_FIELDS
+        )
+
+    def dump(self, token):
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return pickle.dumps(token, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, data):
+        # Каждый запрос получает свои экземпляры токена и пользователя.
+        token = pickle.loads(data)
+        return token.user, token
+
+    def authenticate_credentials(self, key):
+        name = cache_key(key)
+        data = local_tokens.get(name)
+        if data is None and not is_shared_cache():
+            data = self.dump(self.get_queryset().filter(key=key).first())
+            local_tokens.set(name, data)
+        elif data is None:
+            data = cache.get(name)
+            if data is None or data == INVALIDATED:
+                fresh = self.dump(self.get_queryset().filter(key=key).first())
+                if data is None and cache.add(
+                    name, fresh, settings.TOKEN_CACHE_TIMEOUT
+                ):
+                    local_tokens.set(name, fresh)
+                data = fresh
+            else:
+                local_tokens.set(name, data)
+        return self.load(data)
+
+    async def aauthenticate_credentials(self, key):
+        name = cache_key(key)
+        data = local_tokens.get(name)
+        if data is None and not is_shared_cache():
+            data = self.dump(
+                await self.get_queryset().filter(key=key).afirst()
+            )
+            local_tokens.set(name, data)
+        elif data is None:
+            data = await cache.aget(name)
+            if data is None or data == INVALIDATED:
+                fresh = self.dump(
+                    await self.get_queryset().filter(key=key).afirst()
+                )
+                if data is None and await cache.aadd(
+                    name, fresh, settings.TOKEN_CACHE_TIMEOUT
+                ):
+                    local_tokens.set(name, fresh)
+                data = fresh
+            else:
+                local_tokens.set(name, data)
+        return self.load(data)
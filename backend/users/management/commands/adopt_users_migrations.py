@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.recorder import MigrationRecorder
+
+# Миграции users, которые соответствуют таблицам, созданным
+# до появления истории миграций users (migrate --run-syncdb).
+ADOPTED_MIGRATIONS = (
+    '0001_initial',
+    '0002_follow_follow_unique_object',
+    '0003_alter_follow_options',
+)
+TABLES = ('users_customuser', 'users_follow')
+
+
+class Command(BaseCommand):
+    """
+    Перевод базы, созданной без миграций users, на историю
+    миграций: migrate в такой базе останавливается
+    с InconsistentMigrationHistory, потому что миграции admin
+    и authtoken применены раньше users.0001_initial.
+    """
+
+    help = ('Отметка миграций users 0001-0003 как примененных в базе, '
+            'где таблицы пользователей созданы без миграций')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        recorder = MigrationRecorder(connection)
+        if any(app == 'users' for app, _ in recorder.applied_migrations()):
+            self.stdout.write('Миграции users уже записаны, ничего не делаем')
+            return
+        missing = set(TABLES) - set(connection.introspection.table_names())
+        if missing:
+            raise CommandError(
+                f'Нет таблиц {", ".join(sorted(missing))}: '
+                'для новой базы достаточно migrate'
+            )
+        for name in ADOPTED_MIGRATIONS:
+            recorder.record_applied('users', name)
+        self.stdout.write(self.style.SUCCESS(
+            'Миграции users 0001-0003 отмечены как примененные, '
+            'дальше выполните migrate и reconcile_counters'
+        ))
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+def drop_unique_auth(apps, schema_editor):
+    """
+    Ограничение unique_auth есть только в базах, созданных
+    миграцией 0001; в базах из syncdb его нет.
+    """
+    model = apps.get_model('users', 'CustomUser')
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection.get_constraints(
+            cursor, model._meta.db_table
+        )
+    if 'unique_auth' in constraints:
+        schema_editor.remove_constraint(model, models.UniqueConstraint(
+            fields=('email', 'username'), name='unique_auth'
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_unique_auth, migrations.RunPython.noop),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='customuser',
+                    name='unique_auth',
+                ),
+            ],
+        ),
+    ]
@@ -31,6 +31,9 @@ class CustomUserSerializer(UserSerializer):
         """
         Отображение подписки на автора.
         """
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         user = self.context['request'].user
 
         if user.is_anonymous:
@@ -51,9 +54,6 @@ class SubscriptionSerializer(CustomUserSerializer):
     recipes = serializers.SerializerMethodField(
         method_name='get_recipes'
     )
-    recipes_count = serializers.SerializerMethodField(
-        method_name='get_recipes_count'
-    )
 
     def get_srs(self):
         """
@@ -68,6 +68,13 @@ class SubscriptionSerializer(CustomUserSerializer):
         """
         Получение рецептов автора.
         """
+        author_recipes = getattr(obj, 'limited_recipes', None)
+        if author_recipes is not None:
+            return self.get_srs()(
+                author_recipes,
+                context={'request': self.context.get('request')},
+                many=True
+            ).data
         author_recipes = Recipe.objects.filter(author=obj)
 
         if 'recipes_limit' in self.context.get('request').GET:
@@ -83,13 +90,8 @@ class SubscriptionSerializer(CustomUserSerializer):
             return serializer.data
         return []
 
-    def get_recipes_count(self, obj):
-        """
-        Получение количества рецептов автора.
-        """
-        return obj.recipes.count()
-
     class Meta:
         model = CustomUser
         fields = ('id', 'username', 'first_name', 'last_name', 'email',
-                  'is_subscribed', 'recipes', 'recipes_count')
+                  'is_subscribed', 'recipes', 'recipes_count',
+                  'followers_count')
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .models import CustomUser
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """
+    Сброс токена в кэше после выхода или удаления пользователя.
+    """
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, created, update_fields=None,
+                           **kwargs):
+    """
+    Сброс токенов пользователя в кэше после смены пароля,
+    деактивации или изменения профиля. Обновление
+    last_login при входе кэш не затрагивает.
+    """
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    # У пользователя из аутентификации токен уже загружен.
+    try:
+        invalidate_tokens([instance.auth_token.key])
+    except Token.DoesNotExist:
+        pass
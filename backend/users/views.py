@@ -1,11 +1,18 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Prefetch, Value
+from django.http import Http404, HttpResponse
 from djoser.views import UserViewSet
+from foodgram_backend.async_views import AsyncReadMixin
+from foodgram_backend.db import insert_link
+from foodgram_backend.db_router import ReplicaReadMixin
+from foodgram_backend.middleware import ServerTimingMixin
+from recipes.counters import change_counter
+from recipes.models import FeedEntry, Recipe
 from recipes.pagination import CustomPageNumberPagination
+from recipes.views import parse_pk
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.generics import get_object_or_404
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
@@ -13,7 +20,8 @@ from .models import CustomUser, Follow
 from .serializers import CustomUserSerializer, SubscriptionSerializer
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(AsyncReadMixin, ReplicaReadMixin, ServerTimingMixin,
+                        UserViewSet):
     """
     Вьюсет для модели пользователя
     наследуется от djoser.views.
@@ -22,6 +30,38 @@ class CustomUserViewSet(UserViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     pagination_class = CustomPageNumberPagination
+    cursor_ordering = ('id',)
+    async_actions = ('subscriptions',)
+
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return None
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            recipes_limit = -1
+        if recipes_limit < 0:
+            raise ValidationError(
+                {'recipes_limit': 'Ожидается неотрицательное целое число'}
+            )
+        return recipes_limit
+
+    def get_subscriptions_queryset(self, authors):
+        """
+        Авторы с первыми recipes_limit рецептами: рецепты всех
+        авторов страницы выбираются одним запросом
+        с ROW_NUMBER() OVER (PARTITION BY author_id).
+        """
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        return authors.annotate(
+            is_subscribed=Value(True),
+        ).order_by('id').prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
 
     @action(
         detail=False,
@@ -33,14 +73,27 @@ class CustomUserViewSet(UserViewSet):
         """
         Генерация списка подписок пользователя.
         """
-        user = self.request.user
-        user_subscriptions = user.follower.all()
-        authors = [item.author.id for item in user_subscriptions]
-        queryset = CustomUser.objects.filter(pk__in=authors)
+        queryset = self.get_subscriptions_queryset(
+            CustomUser.objects.filter(followed__user=request.user)
+        )
         paginated_queryset = self.paginate_queryset(queryset)
         serializer = self.get_serializer(paginated_queryset, many=True)
         return self.get_paginated_response(serializer.data)
 
+    async def asubscriptions(self, request):
+        queryset = self.get_subscriptions_queryset(
+            CustomUser.objects.filter(followed__user=request.user)
+        )
+        page = await self.apaginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def change_follow_counters(self, user_id, author_id, delta):
+        change_counter(CustomUser.objects.filter(pk=author_id),
+                       'followers_count', delta)
+        change_counter(CustomUser.objects.filter(pk=user_id),
+                       'following_count', delta)
+
     @action(
         detail=True,
         methods=('post', 'delete'),
@@ -48,21 +101,32 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscribe(self, request, id=None):
         """
-        Реализация подписки на автора.
+        Реализация подписки на автора. Подписка и отписка выполняются
+        одним запросом, повторные запросы получают 400,
+        запросы к несуществующему автору - 404.
         """
-        user = get_object_or_404(CustomUser, username=request.user.username)
-        author = get_object_or_404(CustomUser, pk=id)
+        user = request.user
+        author_id = parse_pk(id)
 
         if request.method == 'POST':
-            if user == author:
+            if author_id == user.pk:
                 content = {'errors': 'Нельзя подписаться на себя'}
                 return Response(content, status=status.HTTP_400_BAD_REQUEST)
-            try:
-                Follow.objects.create(user=user, author=author)
-            except IntegrityError:
+            with transaction.atomic():
+                created = insert_link(
+                    Follow, {'user': user.pk}, 'author', author_id
+                )
+                if created:
+                    self.change_follow_counters(user.pk, author_id, 1)
+                    FeedEntry.objects.follow(user.pk, author_id)
+            if not created:
+                if not CustomUser.objects.filter(pk=author_id).exists():
+                    raise Http404
                 content = {'errors': 'Вы уже подписаны на данного автора'}
                 return Response(content, status=status.HTTP_400_BAD_REQUEST)
-            follows = CustomUser.objects.all().filter(username=author)
+            follows = self.get_subscriptions_queryset(
+                CustomUser.objects.filter(pk=author_id)
+            )
             serializer = SubscriptionSerializer(
                 follows,
                 context={'request': request},
@@ -70,12 +134,17 @@ class CustomUserViewSet(UserViewSet):
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if request.method == 'DELETE':
-            try:
-                subscription = Follow.objects.get(user=user, author=author)
-            except ObjectDoesNotExist:
-                content = {'errors': 'Вы не подписаны на данного автора'}
-                return Response(content, status=status.HTTP_400_BAD_REQUEST)
-            subscription.delete()
-            return HttpResponse('Вы успешно отписаны от этого автора',
-                                status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                user=user, author_id=author_id
+            ).delete()
+            if deleted:
+                self.change_follow_counters(user.pk, author_id, -deleted)
+                FeedEntry.objects.unfollow(user.pk, author_id)
+        if not deleted:
+            if not CustomUser.objects.filter(pk=author_id).exists():
+                raise Http404
+            content = {'errors': 'Вы не подписаны на данного автора'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+        return HttpResponse('Вы успешно отписаны от этого автора',
+                            status=status.HTTP_204_NO_CONTENT)